@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# bench_links.py - Throughput of rename_redirect's link replacement
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure replace_links and fix_links throughput as the number of redirects grows.
+
+Every run rewrites the same synthetic corpus (see corpus.py) against a
+mapping of -redirects old redirects; only the link targets change. The
+fix_links numbers use rewrite_text, which is what RedirectBot runs for
+each fetched page.
+
+Each benchmark is timed twice: looking links up in a plain dict
+("dict") and through a TitleIndex, which normalises every link target
+first, as RedirectBot does ("title_index"). A fresh TitleIndex is built
+for every repetition, outside the timing, so its memoized lookups start
+cold.
+
+    python benchmarks/bench_links.py -redirects 10 -redirects 10000 -json links.json
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import make_corpus  # noqa
+from scripts.rename_redirect import RedirectBot, TitleIndex, replace_links, rewrite_text  # noqa
+
+DEFAULT_REDIRECTS = [10, 100, 1000, 10000]
+
+
+def best_of(repeat, function, setup):
+    best = None
+    for attempt in range(repeat):
+        argument = setup()
+        started = time.time()
+        function(argument)
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench(pages, redirects, repeat=3):
+    redirect_map, corpus = make_corpus(pages, redirects)
+    texts = [text for title, namespace, text in corpus]
+    megabytes = sum(len(text.encode('utf-8')) for text in texts) / 1e6
+    table_templates = RedirectBot.table_templates
+
+    def run_replace_links(lookup):
+        for text in texts:
+            replace_links(lookup, text)
+
+    def run_fix_links(lookup):
+        for title, namespace, text in corpus:
+            rewrite_text(lookup, title, namespace, text, table_templates)
+
+    lookups = (('dict', lambda: redirect_map), ('title_index', lambda: TitleIndex(redirect_map)))
+    results = []
+    for function_name, function in (('replace_links', run_replace_links), ('fix_links', run_fix_links)):
+        for lookup_name, setup in lookups:
+            elapsed = best_of(repeat, function, setup)
+            results.append({
+                'benchmark': function_name,
+                'lookup': lookup_name,
+                'redirects': redirects,
+                'pages': len(texts),
+                'megabytes': round(megabytes, 3),
+                'seconds': round(elapsed, 4),
+                'megabytes_per_second': round(megabytes / elapsed, 3),
+                'pages_per_second': round(len(texts) / elapsed, 1),
+            })
+    return results
+
+
+def run(pages=200, redirect_counts=None, repeat=3):
+    results = []
+    for redirects in redirect_counts or DEFAULT_REDIRECTS:
+        for result in bench(pages, redirects, repeat):
+            print('%-13s %-11s %6d redirects: %7.2f MB/s, %8.1f pages/s (%.1f MB in %.3f s)'
+                  % (result['benchmark'], result['lookup'], redirects, result['megabytes_per_second'],
+                     result['pages_per_second'], result['megabytes'], result['seconds']))
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-pages', type=int, default=200, help='number of synthetic pages')
+    parser.add_argument('-redirects', type=int, action='append', help='number of old redirects (repeatable)')
+    parser.add_argument('-repeat', type=int, default=3, help='runs per measurement, the fastest is kept')
+    parser.add_argument('-json', metavar='FILE', help='also write the results to FILE')
+    args = parser.parse_args()
+
+    results = run(args.pages, args.redirects, args.repeat)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# bench_rewrite_scaling.py - Scaling of the page-rewrite stage over cores
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure how rename_redirect's page-rewrite stage scales from 1 to N cores.
+
+Pages of a synthetic corpus are rewritten in batches by a Rewriter with
+1, 2, ... -cores worker processes, the same way RedirectBot.run() does:
+links are looked up through a TitleIndex built for the run. The output
+of every run is checked against the single process one.
+
+    python benchmarks/bench_rewrite_scaling.py -pages 2000 -cores 8
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import make_corpus  # noqa
+from pywikibot.tools import itergroup  # noqa
+from scripts.rename_redirect import RedirectBot, Rewriter, TitleIndex  # noqa
+
+
+def bench(redirect_map, corpus, workers):
+    started = time.time()
+    rewriter = Rewriter(TitleIndex(redirect_map), RedirectBot.table_templates, workers)
+    setup = time.time() - started
+    results = []
+    started = time.time()
+    for tasks in itergroup(corpus, rewriter.batch_size):
+        results.extend(rewriter.rewrite(tasks))
+    elapsed = time.time() - started
+    rewriter.close()
+    return setup, elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-pages', type=int, default=1000, help='number of synthetic pages')
+    parser.add_argument('-redirects', type=int, default=1000, help='number of old redirects in the mapping')
+    parser.add_argument('-cores', type=int, default=multiprocessing.cpu_count(), help='largest pool to time')
+    args = parser.parse_args()
+
+    redirect_map, corpus = make_corpus(args.pages, args.redirects)
+    megabytes = sum(len(text) for title, namespace, text in corpus) / 1e6
+    print('%d pages, %.1f MB of wikitext, %d redirects' % (len(corpus), megabytes, len(redirect_map)))
+    baseline = None
+    for workers in range(1, args.cores + 1):
+        setup, elapsed, results = bench(redirect_map, corpus, workers)
+        if baseline is None:
+            baseline = (elapsed, results)
+        elif results != baseline[1]:
+            print('%2d cores: results differ from 1 core!' % workers)
+            return 1
+        print('%2d cores: %7.2f s, %8.1f pages/s, %6.2f MB/s, speedup %.2fx (%.0f ms pool start)'
+              % (workers, elapsed, len(corpus) / elapsed, megabytes / elapsed, baseline[0] / elapsed,
+                 setup * 1000))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# bench_scheduler.py - Dispatch overhead of the dispatcher's scheduler
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure how long one dispatch takes with thousands of cron entries.
+
+The heap scheduler is compared against the old approach of parsing every
+CronTab and taking min() over all next fire times on each loop. Time is
+simulated, so the benchmark does not sleep.
+
+    python benchmarks/bench_scheduler.py -jobs 1000 -jobs 5000 -json scheduler.json
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+from datetime import datetime
+import json
+import os
+import random
+import sys
+import time
+
+import crontab
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import Scheduler  # noqa
+
+START = 1420070400.0  # 2015-01-01 00:00 UTC
+
+
+def make_schedules(count, seed=0):
+    rng = random.Random(seed)
+    schedules = {}
+    for number in range(count):
+        minute = rng.choice(['*', '*/5', '*/15', str(rng.randint(0, 59))])
+        hour = rng.choice(['*', '*', str(rng.randint(0, 23))])
+        weekday = rng.choice(['*', '*', '*', str(rng.randint(0, 6))])
+        schedules['job%d' % number] = '%s %s * * %s' % (minute, hour, weekday)
+    return schedules
+
+
+def legacy_dispatch(schedules, now):
+    times = {}
+    for job_name in schedules:
+        ctab = crontab.CronTab(schedules[job_name])
+        times[now + ctab.next(now=datetime.fromtimestamp(now))] = job_name
+    return min(times)
+
+
+def bench_legacy(schedules, dispatches):
+    now = START
+    started = time.time()
+    for dispatch in range(dispatches):
+        now = legacy_dispatch(schedules, now)
+    return (time.time() - started) / dispatches
+
+
+def bench_heap(schedules, dispatches):
+    started = time.time()
+    scheduler = Scheduler(schedules, now=START)
+    setup = time.time() - started
+    fired = 0
+    started = time.time()
+    for dispatch in range(dispatches):
+        fired += len(scheduler.pop_due(scheduler.peek()[0]))
+    return setup, (time.time() - started) / dispatches, fired
+
+
+def run(job_counts=None, dispatches=50):
+    results = []
+    for count in job_counts or [100, 1000, 5000]:
+        schedules = make_schedules(count)
+        legacy = bench_legacy(schedules, max(1, dispatches // 10))
+        setup, heap, fired = bench_heap(schedules, dispatches)
+        per_fire = heap * dispatches / max(fired, 1)
+        print('%5d jobs: legacy %8.2f ms/dispatch, heap %8.3f ms/dispatch, '
+              '%.3f ms/fire (%d fires, %.1f ms setup)'
+              % (count, legacy * 1000, heap * 1000, per_fire * 1000, fired, setup * 1000))
+        results.append({
+            'benchmark': 'scheduler',
+            'jobs': count,
+            'legacy_ms_per_dispatch': round(legacy * 1000, 3),
+            'heap_ms_per_dispatch': round(heap * 1000, 4),
+            'heap_ms_per_fire': round(per_fire * 1000, 4),
+            'heap_setup_ms': round(setup * 1000, 2),
+            'fires': fired,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-jobs', type=int, action='append', help='number of cron entries (repeatable)')
+    parser.add_argument('-dispatches', type=int, default=50, help='dispatch loop iterations to time')
+    parser.add_argument('-json', metavar='FILE', help='also write the results to FILE')
+    args = parser.parse_args()
+
+    results = run(args.jobs, args.dispatches)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
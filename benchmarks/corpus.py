@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# corpus.py - Synthetic wikitext for the benchmarks
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generate pages that look like the ones rename_redirect works on.
+
+A page is made of sections of prose, wikitables, the occasional huge
+table of several thousand rows and tables opened by the Mexico TV station
+table templates. Links point to old redirects, to unrelated pages and to
+File: and Category: pages. The same seed always gives the same corpus.
+"""
+
+from __future__ import unicode_literals
+
+import random
+
+TABLE_TEMPLATES = ("{{Mexico TV station table/top}}", "{{Mexico TV station table/top2}}")
+WORDS = ('station', 'channel', 'network', 'the', 'of', 'and', 'signal', 'digital', 'broadcast', 'transmitter')
+
+
+def make_redirect_map(redirects):
+    return dict(('XE%05d-TV' % number, 'XE%05d-TDT' % number) for number in range(redirects))
+
+
+class CorpusGenerator(object):
+    def __init__(self, redirect_map, seed=0, huge_table_rows=5000):
+        self.rng = random.Random(seed)
+        self.old_titles = sorted(redirect_map)
+        self.huge_table_rows = huge_table_rows
+
+    def link(self):
+        rng = self.rng
+        kind = rng.random()
+        if kind < 0.1:
+            return '[[File:Logo %d.png|thumb|Logo]]' % rng.randint(0, 99)
+        if kind < 0.15:
+            return '[[Category:Television stations in Mexico]]'
+        if kind < 0.6:
+            link = rng.choice(self.old_titles)
+            if rng.random() < 0.2:
+                link += '|' + rng.choice(WORDS)
+            return '[[%s]]' % link
+        return '[[Other page %d|other]]' % rng.randint(0, 999)
+
+    def prose(self):
+        return ' '.join(self.link() if self.rng.random() < 0.1 else self.rng.choice(WORDS)
+                        for word in range(200)) + '\n\n'
+
+    def table(self, opening, rows):
+        lines = ['|-\n| %s || %s || %d\n' % (self.link(), self.rng.choice(WORDS), self.rng.randint(2, 60))
+                 for row in range(rows)]
+        return opening + '\n' + ''.join(lines) + '|}\n'
+
+    def page(self, number):
+        rng = self.rng
+        parts = []
+        for section in range(rng.randint(3, 12)):
+            kind = rng.random()
+            if kind < 0.55:
+                parts.append(self.prose())
+            elif kind < 0.75:
+                parts.append(self.table('{| class="wikitable"', rng.randint(10, 300)))
+            elif kind < 0.78:
+                parts.append(self.table('{| class="wikitable sortable"', self.huge_table_rows))
+            else:
+                parts.append(self.table(rng.choice(TABLE_TEMPLATES), rng.randint(10, 300)))
+        title = rng.choice(['Television in Mexico %d', 'List of stations %d', 'Channel %d'])
+        return (title % number, rng.choice([0, 0, 0, 4, 10]), ''.join(parts))
+
+
+def make_corpus(pages, redirects, seed=0):
+    """Return (redirect_map, [(title, namespace, text)]) of random pages."""
+    redirect_map = make_redirect_map(redirects)
+    generator = CorpusGenerator(redirect_map, seed)
+    return redirect_map, [generator.page(number) for number in range(pages)]
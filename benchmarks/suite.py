@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# suite.py - Runs the benchmarks and records their results
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Run the link replacement and scheduler benchmarks and write one JSON file.
+
+The file holds the results of bench_links.py and bench_scheduler.py
+together with the Python version and the time of the run, so results of
+different commits can be compared.
+
+    python benchmarks/suite.py -json results.json
+    python benchmarks/suite.py -quick -json results.json
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import platform
+import time
+
+import bench_links
+import bench_scheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-json', metavar='FILE', default='benchmark-results.json',
+                        help='file to write the results to (default: %(default)s)')
+    parser.add_argument('-quick', action='store_true', help='smaller corpus and fewer cron entries')
+    args = parser.parse_args()
+
+    if args.quick:
+        links = bench_links.run(pages=50, redirect_counts=[10, 1000], repeat=1)
+        scheduler = bench_scheduler.run([100, 1000], dispatches=20)
+    else:
+        links = bench_links.run()
+        scheduler = bench_scheduler.run([100, 1000, 5000, 20000])
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'links': links,
+        'scheduler': scheduler,
+    }
+    with open(args.json, 'w') as json_file:
+        json.dump(results, json_file, indent=2, sort_keys=True)
+    print('Results written to %s' % args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# executor.py - Runs the jobs fired by the task dispatcher
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from collections import deque
+import logging
+import multiprocessing
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from logqueue import QueueHandler, set_job
+
+logger = logging.getLogger('dispatcher')
+
+OVERLAP_POLICIES = ('skip', 'queue', 'coalesce')
+EXECUTORS = ('thread', 'process')
+
+
+class LazyModule(object):
+
+    """A job module that is imported the first time its job runs."""
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+        self.import_time = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.module is None:
+                started = time.time()
+                self.module = __import__(self.name, fromlist=['main'])
+                self.import_time = time.time() - started
+                logger.info('Imported %s in %.2f seconds' % (self.name, self.import_time))
+        return self.module
+
+    def main(self):
+        return self.load().main()
+
+
+class Job(object):
+
+    """A job from config.yaml together with its execution limits.
+
+    concurrency is how many runs of the job may be active at once. overlap
+    decides what happens when the job fires while that many are active:
+    'skip' drops the new run, 'queue' keeps every fire waiting and
+    'coalesce' keeps at most one waiting run. timeout is in seconds.
+
+    With executor 'process' the job runs in a pooled subprocess, limited to
+    memory_limit megabytes of address space and cpu_limit CPU seconds per
+    run.
+    """
+
+    def __init__(self, name, module, concurrency=1, overlap='skip', timeout=None,
+                 executor='thread', memory_limit=None, cpu_limit=None):
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError('%s: overlap must be one of %s' % (name, ', '.join(OVERLAP_POLICIES)))
+        if executor not in EXECUTORS:
+            raise ValueError('%s: executor must be one of %s' % (name, ', '.join(EXECUTORS)))
+        self.name = name
+        self.module = module
+        self.concurrency = concurrency
+        self.overlap = overlap
+        self.timeout = timeout
+        self.executor = executor
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+
+
+class Run(object):
+
+    """One run of a job, from the time it was due to its exit status."""
+
+    def __init__(self, job, scheduled):
+        self.job = job
+        self.scheduled = scheduled
+        self.start = None
+        self.end = None
+        self.status = None  # 'ok', 'error', 'timeout' or 'skipped'
+        self.timed_out = False
+        self.worker = None  # ProcessWorker of a process run
+
+
+def run_job(module):
+    """Run a job module's main() and return its exit status."""
+    try:
+        module.main()
+    except SystemExit as error:
+        if error.code not in (None, 0):
+            return 'error'
+    except Exception:
+        logger.exception('%s failed' % module.name)
+        return 'error'
+    return 'ok'
+
+
+def worker_main(job_name, module_name, conn, log_queue, memory_limit, cpu_limit):
+    # runs in the job subprocess
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue, job=job_name, picklable=True)]
+    root.setLevel(logging.DEBUG)
+    if resource is not None and memory_limit:
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    module = LazyModule(module_name)
+    while True:
+        try:
+            command = conn.recv()
+        except EOFError:  # the dispatcher went away
+            return
+        if command != 'run':
+            return
+        if resource is not None and cpu_limit:  # the limit counts CPU time since the process started
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+            soft = int(usage.ru_utime + usage.ru_stime + cpu_limit) + 1
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        conn.send(run_job(module))
+
+
+class ProcessWorker(object):
+
+    """A subprocess running one job's main() each time it is asked to.
+
+    The job module stays imported between runs.
+    """
+
+    def __init__(self, job, log_queue):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=worker_main, name=job.name,
+            args=(job.name, job.module.name, child_conn, log_queue, job.memory_limit, job.cpu_limit))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()  # so recv() notices when the worker dies
+
+    def run(self):
+        self.conn.send('run')
+        try:
+            return self.conn.recv()
+        except EOFError:  # killed by a timeout or by its limits
+            self.process.join()
+            logger.error('Worker process of %s exited with code %s' % (self.process.name, self.process.exitcode))
+            return 'error'
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def terminate(self):
+        self.process.terminate()
+
+
+class ProcessPool(object):
+
+    """Idle job subprocesses, kept for the next run of the same job."""
+
+    def __init__(self):
+        self.log_queue = multiprocessing.Queue()
+        self.lock = threading.Lock()
+        self.idle = {}
+        forwarder = threading.Thread(target=self.forward_logs, name='log forwarder')
+        forwarder.daemon = True
+        forwarder.start()
+
+    def forward_logs(self):
+        while True:
+            record = self.log_queue.get()
+            logger.handle(record)  # the record keeps the job it was tagged with
+
+    def acquire(self, job):
+        with self.lock:
+            workers = self.idle.get(job.name)
+            if workers:
+                return workers.pop()
+        return ProcessWorker(job, self.log_queue)
+
+    def release(self, job, worker):
+        if worker.alive():
+            with self.lock:
+                self.idle.setdefault(job.name, []).append(worker)
+
+
+class JobThread(threading.Thread):
+    def __init__(self, run, executor):
+        super(JobThread, self).__init__(name=run.job.name)
+        self.daemon = True
+        self.run_info = run
+        self.executor = executor
+
+    def run(self):
+        job = self.run_info.job
+        set_job(job.name)
+        if job.executor == 'process':
+            worker = self.executor.processes.acquire(job)
+            self.run_info.worker = worker
+            status = worker.run()
+            self.executor.processes.release(job, worker)
+        else:
+            status = run_job(job.module)
+        set_job(None)  # finished() starts other jobs from this thread
+        self.executor.finished(self.run_info, status)
+
+
+class Executor(object):
+
+    """Starts fired jobs while keeping to the global and per-job limits.
+
+    Runs that cannot start because all workers are busy wait in a FIFO
+    queue. A process run that times out is killed. Python threads cannot
+    be stopped, so a thread run that times out is only marked and logged;
+    it keeps its worker until it returns.
+    """
+
+    history_size = 1000
+
+    def __init__(self, jobs, workers=4, metrics=None):
+        self.jobs = jobs
+        self.workers = workers
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.active = dict((job_name, 0) for job_name in jobs)
+        self.total_active = 0
+        self.waiting = deque()
+        self.history = deque(maxlen=self.history_size)  # finished runs
+        self.processes = None
+        if any(job.executor == 'process' for job in jobs.values()):
+            self.processes = ProcessPool()
+
+    def submit(self, job_name, scheduled):
+        job = self.jobs[job_name]
+        run = Run(job, scheduled)
+        with self.lock:
+            if self.active[job_name] >= job.concurrency:
+                if job.overlap == 'skip':
+                    logger.info('Not starting %s, already running' % job_name)
+                    self.record(run, 'skipped')
+                    return
+                if job.overlap == 'coalesce' and any(waiting.job is job for waiting in self.waiting):
+                    logger.info('Not queuing %s, a run is already waiting' % job_name)
+                    self.record(run, 'skipped')
+                    return
+            logger.info('Queuing %s...' % job_name)
+            self.waiting.append(run)
+            self.start_waiting()
+
+    def start_waiting(self):
+        # called with the lock held
+        for run in list(self.waiting):
+            if self.total_active >= self.workers:
+                break
+            if self.active[run.job.name] >= run.job.concurrency:
+                continue
+            self.waiting.remove(run)
+            self.active[run.job.name] += 1
+            self.total_active += 1
+            logger.info('Starting %s...' % run.job.name)
+            run.start = time.time()
+            if self.metrics is not None:
+                self.metrics.run_started(run)
+            if run.job.timeout:
+                timer = threading.Timer(run.job.timeout, self.timed_out, [run])
+                timer.daemon = True
+                timer.start()
+            JobThread(run, self).start()
+        if self.metrics is not None:
+            self.metrics.queue_changed(len(self.waiting), self.total_active)
+
+    def timed_out(self, run):
+        with self.lock:
+            if run.end is not None:
+                return
+            run.timed_out = True
+        logger.error('%s has been running for more than %s seconds' % (run.job.name, run.job.timeout),
+                     extra={'job': run.job.name})
+        if run.worker is not None:
+            run.worker.terminate()
+
+    def finished(self, run, status):
+        with self.lock:
+            self.active[run.job.name] -= 1
+            self.total_active -= 1
+            if run.timed_out:
+                status = 'timeout'
+            self.record(run, status)
+            self.start_waiting()
+
+    def record(self, run, status):
+        # called with the lock held
+        run.end = time.time()
+        run.status = status
+        self.history.append(run)
+        if self.metrics is not None:
+            self.metrics.run_finished(run)
+        if run.start is not None:
+            logger.info('Finished %s with status %s: due %s, started %s, ended %s (%.1f seconds)'
+                        % (run.job.name, status, format_time(run.scheduled), format_time(run.start),
+                           format_time(run.end), run.end - run.start), extra={'job': run.job.name})
+
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# logqueue.py - Log records written by a single listener thread
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import logging
+from logging.handlers import TimedRotatingFileHandler
+import os
+import re
+import sys
+import threading
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_context = threading.local()
+
+
+def set_job(job_name):
+    """Mark the records logged by the current thread as belonging to job_name."""
+    _context.job = job_name
+
+
+def current_job():
+    return getattr(_context, 'job', None)
+
+
+class QueueHandler(logging.Handler):
+
+    """Puts log records on a queue instead of writing them.
+
+    Python 2 has no logging.handlers.QueueHandler. Records are tagged with
+    the job they belong to, either the given one (in a job subprocess) or
+    the one set for the current thread. Records that cross a process
+    boundary are made picklable first.
+    """
+
+    def __init__(self, queue, job=None, picklable=False):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.job = job
+        self.picklable = picklable
+
+    def emit(self, record):
+        try:
+            if getattr(record, 'job', None) is None:
+                record.job = self.job or current_job()
+            if self.picklable:
+                record.msg = record.getMessage()
+                record.args = None
+                if record.exc_info:
+                    record.exc_text = logging.Formatter().formatException(record.exc_info)
+                    record.exc_info = None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class LogListener(object):
+
+    """Writes the records of every thread and job from one thread.
+
+    Records of the dispatcher, and records not tagged with a job, go to
+    handlers. Records tagged with a job go to a log file of their own in
+    job_log_path that is rotated weekly like the dispatcher log.
+    """
+
+    backup_count = 20
+
+    def __init__(self, handlers, job_log_path=None):
+        self.queue = queue.Queue()
+        self.handlers = handlers
+        self.job_log_path = job_log_path
+        self.job_handlers = {}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='log listener')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Write out the records still queued and close the handlers."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        for handler in self.handlers + list(self.job_handlers.values()):
+            handler.close()
+
+    def job_handler(self, job_name):
+        handler = self.job_handlers.get(job_name)
+        if handler is None:
+            file_name = re.sub(r'[^\w.-]', '_', job_name) + '.log'
+            handler = TimedRotatingFileHandler(os.path.join(self.job_log_path, file_name), when='W0',
+                                               backupCount=self.backup_count, utc=True)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            self.job_handlers[job_name] = handler
+        return handler
+
+    def handle(self, record):
+        job = getattr(record, 'job', None)
+        if job is None or record.name.startswith('dispatcher'):
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        if job is not None and self.job_log_path:
+            self.job_handler(job).handle(record)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            try:
+                self.handle(record)
+            except Exception:  # e.g. a job log that cannot be opened; keep writing the others
+                sys.stderr.write('Could not write a log record of %s:\n' % (getattr(record, 'job', None) or record.name))
+                traceback.print_exc(file=sys.stderr)
@@ -24,88 +24,115 @@
 
 from __future__ import unicode_literals
 
+import argparse
+import atexit
 import os
 import sys
 import logging
 from logging.handlers import TimedRotatingFileHandler
 import time
-import crontab
-import threading
 import yaml
 
-# Setup log file
+from executor import Executor, Job, LazyModule
+from logqueue import LOG_FORMAT, LogListener, QueueHandler
+from metrics import Metrics
+from scheduler import Scheduler
+
 cur_dir = os.path.dirname(os.path.abspath(__file__))
 log_path = cur_dir + "/logs/"  # path to log
 logger = logging.getLogger('dispatcher')  # create logger
-logger.setLevel(logging.DEBUG)  # set overall logging level cutoff
-handler = TimedRotatingFileHandler(log_path + "dispatcher.log", when='W0', backupCount=20, utc=True)  # create a rotating handler (once a week rotation)
-handler.setLevel(logging.DEBUG)  # set handler log level
-handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))  # log file format
-logger.addHandler(handler)
-out_handler = logging.StreamHandler(sys.stdout)  # create stdout handler
-out_handler.setLevel(logging.INFO)  # only see INFO messages
-out_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))  # stdout format
-logger.addHandler(out_handler)
-
-# Setup data file
-with open(os.path.abspath("config.yaml")) as conf:
-    config = yaml.load(conf)
-
-jobs = {}
-schedules = {}
-
-for i in range(len(config["scripts"])):
-    jobs[config["scripts"][i]["name"]] = getattr(__import__('scripts', fromlist=[config["scripts"][i]["module"]]), config["scripts"][i]["module"])
-    schedules[config["scripts"][i]["name"]] = config["scripts"][i]["schedule"]
-
-
-class JobThread(threading.Thread):
-    def __init__(self, job):
-        super(JobThread, self).__init__()
-        self.daemon = True
-        self.job = job
-
-    def run(self):
-        self.job.main()
-
 
-def schedule():
-    times = {}
-    for job_name in jobs.iterkeys():
-        ctab = crontab.CronTab(schedules[job_name])
-        times[time.time() + ctab.next()] = job_name
-    return times
 
+def setup_logging():
+    logger.setLevel(logging.DEBUG)  # set overall logging level cutoff
+    handler = TimedRotatingFileHandler(log_path + "dispatcher.log", when='W0', backupCount=20, utc=True)  # create a rotating handler (once a week rotation)
+    handler.setLevel(logging.DEBUG)  # set handler log level
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))  # log file format
+    out_handler = logging.StreamHandler(sys.stdout)  # create stdout handler
+    out_handler.setLevel(logging.INFO)  # only see INFO messages
+    out_handler.setFormatter(logging.Formatter(LOG_FORMAT))  # stdout format
+    listener = LogListener([handler, out_handler], job_log_path=log_path)  # writes the logs of every thread and job
+    listener.start()
+    atexit.register(listener.stop)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)  # records of job modules at INFO and up
+    root.addHandler(QueueHandler(listener.queue))  # logging only enqueues the record
+
+
+def load_config(path):
+    with open(path) as conf:
+        config = yaml.safe_load(conf)
+
+    jobs = {}
+    schedules = {}
+    for script in config["scripts"]:
+        module = LazyModule('scripts.' + script["module"])  # imported when the job first fires
+        jobs[script["name"]] = Job(script["name"], module, concurrency=script.get("concurrency", 1),
+                                   overlap=script.get("overlap", "skip"), timeout=script.get("timeout"),
+                                   executor=script.get("executor", "thread"),
+                                   memory_limit=script.get("memory_limit"), cpu_limit=script.get("cpu_limit"))
+        schedules[script["name"]] = script["schedule"]
+    return config, jobs, schedules
+
+
+def startup_report(jobs, phases, target=None):
+    """Import every job module and print how long each startup step took."""
+    rows = list(phases)
+    for job_name in sorted(jobs):
+        module = jobs[job_name].module
+        module.load()
+        rows.append(('import %s (%s)' % (module.name, job_name), module.import_time))
+    rows.append(('cold start with every job loaded', sum(seconds for name, seconds in rows)))
+    width = max(len(name) for name, seconds in rows)
+    for name, seconds in rows:
+        print('%s  %7.3f s' % (name.ljust(width), seconds))
+    cold_start = rows[-1][1]
+    if target is not None and cold_start > target:
+        print('Cold start is over the %.3f second target' % target)
+        return 1
+    return 0
 
-running = {}
 
 def main():
-    for job_name, job in jobs.iteritems():
-        running[job_name] = None
+    parser = argparse.ArgumentParser(description='Bot24 task dispatcher')
+    parser.add_argument('--config', default='config.yaml', help='configuration file (default: %(default)s)')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='import every job, print how long startup takes and exit')
+    parser.add_argument('--startup-target', type=float, metavar='SECONDS',
+                        help='with --startup-report, exit with status 1 if cold start takes longer')
+    args = parser.parse_args()
+
+    started = time.time()
+    config, jobs, schedules = load_config(os.path.abspath(args.config))
+    config_loaded = time.time()
+    scheduler = Scheduler(schedules)
+    scheduled = time.time()
+    phases = [('load %s' % args.config, config_loaded - started),
+              ('parse schedules', scheduled - config_loaded)]
+    if args.startup_report:
+        return startup_report(jobs, phases, args.startup_target)
+
+    setup_logging()
+    logger.info('Ready in %.2f seconds with %d jobs' % (time.time() - started, len(jobs)))
+    dispatcher_config = config.get("dispatcher") or {}
+    metrics = Metrics(jobs)
+    if dispatcher_config.get("metrics_file"):
+        metrics.write_every(dispatcher_config["metrics_file"], dispatcher_config.get("metrics_interval", 15))
+    if dispatcher_config.get("metrics_port"):
+        metrics.serve(dispatcher_config["metrics_port"])
+    executor = Executor(jobs, workers=dispatcher_config.get("workers", 4), metrics=metrics)
+    next_fire = None
     while True:
-        times = schedule()
-        minimum = min(list(times))
-        logger.info('Sleeping for %s seconds...' % (int(minimum - time.time())))
-        time.sleep(minimum - time.time())
-        things_to_queue = []
-        for time_val, job_name in dict(times).iteritems():
-            if time_val <= time.time():
-                logger.info('Queuing %s...' % job_name)
-                things_to_queue.append(job_name)
-            del times[time_val]
-        for job_name in things_to_queue:
-            if running[job_name] is None:  # not running
-                logger.info('Starting %s...' % job_name)
-                running[job_name] = JobThread(jobs[job_name])
-                running[job_name].start()
-            elif running[job_name].isAlive() is False:
-                running[job_name] = None
-                logger.info('Starting %s...' % job_name)
-                running[job_name] = JobThread(jobs[job_name])
-                running[job_name].start()
-            else:
-                logger.info('Not starting %s, already running' % job_name)
+        now = time.time()
+        for fire_time, job_name in scheduler.pop_due(now):
+            if now - fire_time > scheduler.max_sleep:
+                logger.warning('%s was due %s seconds ago, running it once for all missed runs' % (job_name, int(now - fire_time)))
+            executor.submit(job_name, fire_time)
+        if scheduler.peek() != next_fire:  # only log when the next fire changes
+            next_fire = scheduler.peek()
+            logger.info('Sleeping for %s seconds...' % (int(next_fire[0] - time.time())))
+        time.sleep(scheduler.sleep_time())
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
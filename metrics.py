@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# metrics.py - Run metrics of the task dispatcher
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import bisect
+import logging
+import os
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = logging.getLogger('dispatcher')
+
+
+class Histogram(object):
+
+    """Counts of observed values per bucket, with their sum."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bucket, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield '%s_bucket{%s,le="%s"} %d' % (name, labels, bucket, cumulative)
+        yield '%s_sum{%s} %.3f' % (name, labels, self.sum)
+        yield '%s_count{%s} %d' % (name, labels, self.count)
+
+
+class JobMetrics(object):
+    duration_buckets = (1, 5, 15, 60, 300, 900, 3600, 14400)
+    drift_buckets = (0.1, 0.5, 1, 5, 15, 60, 300)
+
+    def __init__(self):
+        self.runs = {}  # status -> count
+        self.duration = Histogram(self.duration_buckets)
+        self.drift = Histogram(self.drift_buckets)
+        self.last_success = None
+
+
+class Metrics(object):
+
+    """In-process counters of the runs of every job.
+
+    The executor updates them as runs start and finish. They are rendered
+    in the Prometheus text format, either to a file for node_exporter's
+    textfile collector or over HTTP on a local port.
+    """
+
+    def __init__(self, job_names):
+        self.lock = threading.Lock()
+        self.jobs = dict((job_name, JobMetrics()) for job_name in job_names)
+        self.waiting = 0
+        self.active = 0
+
+    def queue_changed(self, waiting, active):
+        """Record how many runs wait for a worker and how many are running."""
+        with self.lock:
+            self.waiting = waiting
+            self.active = active
+
+    def run_started(self, run):
+        """Record how long after its fire time a run started."""
+        with self.lock:
+            self.jobs[run.job.name].drift.observe(max(0, run.start - run.scheduled))
+
+    def run_finished(self, run):
+        with self.lock:
+            job = self.jobs[run.job.name]
+            job.runs[run.status] = job.runs.get(run.status, 0) + 1
+            if run.start is not None:
+                job.duration.observe(run.end - run.start)
+            if run.status == 'ok':
+                job.last_success = run.end
+
+    def render(self):
+        lines = []
+        with self.lock:
+            jobs = sorted(self.jobs.items())
+            lines.append('# HELP bot24_job_runs_total Finished runs by status (ok, error, timeout, skipped).')
+            lines.append('# TYPE bot24_job_runs_total counter')
+            for job_name, job in jobs:
+                for status, count in sorted(job.runs.items()):
+                    lines.append('bot24_job_runs_total{%s,status="%s"} %d' % (job_label(job_name), status, count))
+            for status in ('skipped', 'timeout'):
+                lines.append('# HELP bot24_job_%s_total Runs with status %s.' % (status, status))
+                lines.append('# TYPE bot24_job_%s_total counter' % status)
+                for job_name, job in jobs:
+                    lines.append('bot24_job_%s_total{%s} %d' % (status, job_label(job_name), job.runs.get(status, 0)))
+            lines.append('# HELP bot24_job_duration_seconds Run time of started runs.')
+            lines.append('# TYPE bot24_job_duration_seconds histogram')
+            for job_name, job in jobs:
+                lines.extend(job.duration.lines('bot24_job_duration_seconds', job_label(job_name)))
+            lines.append('# HELP bot24_job_schedule_drift_seconds Time from the fire time to the start of a run.')
+            lines.append('# TYPE bot24_job_schedule_drift_seconds histogram')
+            for job_name, job in jobs:
+                lines.extend(job.drift.lines('bot24_job_schedule_drift_seconds', job_label(job_name)))
+            lines.append('# HELP bot24_job_last_success_timestamp_seconds End of the last run with status ok.')
+            lines.append('# TYPE bot24_job_last_success_timestamp_seconds gauge')
+            for job_name, job in jobs:
+                if job.last_success is not None:
+                    lines.append('bot24_job_last_success_timestamp_seconds{%s} %.3f'
+                                 % (job_label(job_name), job.last_success))
+            lines.append('# HELP bot24_queue_waiting_runs Runs waiting for a free worker.')
+            lines.append('# TYPE bot24_queue_waiting_runs gauge')
+            lines.append('bot24_queue_waiting_runs %d' % self.waiting)
+            lines.append('# HELP bot24_active_runs Runs being executed.')
+            lines.append('# TYPE bot24_active_runs gauge')
+            lines.append('bot24_active_runs %d' % self.active)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Replace path with the current metrics, without a partial file ever being visible."""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as metrics_file:
+            metrics_file.write(self.render().encode('utf-8'))
+        os.rename(temp_path, path)
+
+    def write_every(self, path, interval=15):
+        """Rewrite path every interval seconds from a daemon thread."""
+        def writer():
+            while True:
+                try:
+                    self.write(path)
+                except (IOError, OSError) as error:
+                    logger.error('Could not write the metrics to %s: %s' % (path, error))
+                time.sleep(interval)
+
+        thread = threading.Thread(target=writer, name='metrics writer')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve the metrics over HTTP from a daemon thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes would flood the dispatcher log
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name='metrics')
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+def job_label(job_name):
+    return 'job="%s"' % job_name.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
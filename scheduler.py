@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# scheduler.py - Cron schedule of the task dispatcher
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+import heapq
+import time
+
+import crontab
+
+
+class Scheduler(object):
+
+    """Keeps the next fire time of every job in a heap.
+
+    Only the job that fired is rescheduled. A job whose fire times were
+    missed (a long sleep or the clock jumping forward) fires once and is
+    then rescheduled from the current time. If the clock jumps backwards
+    every job is rescheduled.
+    """
+
+    max_sleep = 60  # wake up at least this often to notice clock jumps
+
+    def __init__(self, schedules, now=None):
+        if now is None:
+            now = time.time()
+        self.crontabs = {}  # parsed once per job
+        self.heap = []  # (fire time, job name)
+        self.last_check = now
+        for job_name, schedule in schedules.items():
+            self.crontabs[job_name] = crontab.CronTab(schedule)
+        self.reschedule_all(now)
+
+    def next_fire(self, job_name, after):
+        return after + self.crontabs[job_name].next(now=datetime.fromtimestamp(after))
+
+    def reschedule_all(self, now):
+        self.heap = [(self.next_fire(job_name, now), job_name) for job_name in self.crontabs]
+        heapq.heapify(self.heap)
+
+    def peek(self):
+        return self.heap[0]
+
+    def sleep_time(self, now=None):
+        if now is None:
+            now = time.time()
+        return max(0, min(self.heap[0][0] - now, self.max_sleep))
+
+    def pop_due(self, now=None):
+        """Return (fire time, job name) for every job due at now, in fire order."""
+        if now is None:
+            now = time.time()
+        if now < self.last_check:  # clock went backwards
+            self.reschedule_all(now)
+        self.last_check = now
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            fire_time, job_name = self.heap[0]
+            due.append((fire_time, job_name))
+            heapq.heapreplace(self.heap, (self.next_fire(job_name, now), job_name))
+        return due
@@ -29,8 +29,64 @@ This script understands the following command-line arguments:
 
 Furthermore, the following command line parameters are supported:
 
+    -redirectfile  File with one old and new redirect title pair per line.
+
+    -redirectformat:tuple|tsv|jsonl
+                   Format of -redirectfile. Guessed from the file extension
+                   (.tsv, .jsonl, .ndjson) if not given; "tuple" otherwise.
+                   Required for .json files.
+
     -summary       Summary of the edit made by bot.
 
+    -linklog:file  Write a summary of the redirects, replaced and skipped
+                   links and saves of the run to file. Every event is
+                   also recorded as a JSON line in file.jsonl.
+
+    -tabletemplate Wikitext that opens a table in which links are fixed on
+                   mainspace pages, e.g. -tabletemplate:"{{Foo/top}}". Can
+                   be given multiple times and replaces the default
+                   Mexico TV station table markers.
+
+    -saveworkers:n Number of threads saving pages at the same time.
+                   Defaults to 1.
+
+    -editrate:n    Save at most n pages per minute across all workers.
+
+    -rewriteworkers:n
+                   Number of processes fixing the links of fetched pages.
+                   Defaults to 1, which rewrites them in this process.
+
+    -pagestore:file
+                   Keep the original and rewritten text of pages in the
+                   given SQLite file instead of in memory until they are
+                   saved.
+
+    -journal:file  Record initialised redirects, rewritten pages and saves
+                   in the given file.
+
+    -journalsync:n Write and fsync the journal at least every n seconds.
+                   Defaults to 5.
+
+    -resume        Continue the run recorded in -journal, skipping the
+                   redirects and pages it already handled. Rewritten pages
+                   that were not saved yet are taken from -pagestore
+                   without fetching them again.
+
+    -dump:file     Look for pages linking to the old redirects in a MediaWiki
+                   XML dump (.xml, .bz2, .gz or .7z) instead of asking the
+                   API. Only pages whose links change in the dump are
+                   fetched, rewritten and saved.
+
+    -patch:file    With -dump, do not touch the wiki: write the changes as
+                   a unified diff to file and print what would be replaced.
+                   The redirects are not checked or created, so this runs
+                   without network access.
+
+    -profile       Time the phases of the run, count API calls and print
+                   a summary at the end. With -profile:file, cProfile
+                   statistics of the main thread are written to file for
+                   pstats.
+
 """
 
 from __future__ import unicode_literals
@@ -39,20 +95,454 @@ __version__ = '$Id$'
 
 import ast
 import codecs
+from contextlib import contextmanager
+import cProfile
+import difflib
+import json
+import multiprocessing
 import os
+import sqlite3
+import threading
 import time
 import re
 
+try:
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
+
+try:
+    process_time = time.process_time
+except AttributeError:  # Python 2, where time.clock is the CPU time of the process on Unix
+    process_time = time.clock
+
 import pywikibot
-from pywikibot import Bot, config, pagegenerators
+from pywikibot import Bot, config, pagegenerators, xmlreader
+from pywikibot.data import api
+from pywikibot.site import Namespace
+from pywikibot.tools import itergroup
 
 docuReplacements = {
     '&params;': pagegenerators.parameterHelp
 }
 
+TABLE_PATTERN = re.compile(r'\{\|.*\|\}', flags=re.S)
+
+LINK_PATTERN = re.compile(
+    r'(?<=\[\[)(?P<title>.*?)(?:#(?P<section>.*?))?(?:\|.*?)?(?=\]\])')
+
+
+WHITESPACE_PATTERN = re.compile(r'[\s_]+', flags=re.U)
+
+TUPLE_LINE_PATTERN = re.compile(
+    r"""^\(\s*u?(?P<q1>['"])(?P<old>[^'"\\]*)(?P=q1)\s*,\s*u?(?P<q2>['"])(?P<new>[^'"\\]*)(?P=q2)\s*,?\s*\)\s*$""")
+
+
+def replace_links(redirect_map, text, dry=False):
+    """Replace links to any old redirect in redirect_map in one scan."""
+    replaced = 0
+    chunks = []
+    copied = 0  # Offset up to which text has been copied into chunks
+    curpos = 0
+    lookup = redirect_map.get
+
+    while True:
+        match = LINK_PATTERN.search(text, curpos)
+        if not match:
+            break
+        title = match.group('title')
+        if not title.strip():
+            curpos = max(match.end(), match.start() + 1)  # [[]] is a zero-width match
+            continue
+        curpos = match.end('title')
+        if title.startswith(("File:", "Category:")):
+            continue
+        replacement = lookup(title)
+        if replacement is not None:
+            replaced += 1
+            if not dry:
+                chunks.append(text[copied:match.start('title')])
+                chunks.append(replacement)
+                copied = curpos
+    if dry:
+        return replaced
+    if not replaced:
+        return (replaced, text)
+    chunks.append(text[copied:])
+    return (replaced, "".join(chunks))
+
+
+def default_namespaces():
+    """Return the namespace rules of TitleIndex for a wiki that has not been asked."""
+    namespaces = {}
+    for number, name in Namespace.canonical_namespaces.items():
+        namespaces[name.lower()] = (number, name, 'first-letter')
+    namespaces['image'] = (6, 'File', 'first-letter')
+    return namespaces
+
+
+def site_namespaces(site):
+    """Return the namespace rules of TitleIndex for site."""
+    namespaces = {}
+    for number, namespace in site.namespaces.items():
+        case = getattr(namespace, 'case', 'first-letter')
+        for name in namespace:
+            namespaces[name.lower()] = (number, namespace.custom_name, case)
+    return namespaces
+
+
+class TitleIndex(object):
+
+    """Looks up the new title of an old redirect by the canonical form of a link.
+
+    Link targets are normalised the way MediaWiki does: underscores and
+    runs of whitespace become one space, the namespace prefix takes its
+    local name and the first letter is upper-cased in namespaces with
+    first-letter case. Lookups are memoized per link target as written.
+
+    Links to File: and Category: pages without a leading colon embed the
+    file or categorise the page, and are left alone. With a leading colon,
+    as in [[:Category:Foo]], they are ordinary links and are rewritten,
+    keeping the colon. A new title in one of those namespaces always gets
+    a leading colon, so that a link is never turned into a categorisation.
+    """
+
+    skip_namespaces = (6, 14)
+    max_cache = 100000
+
+    def __init__(self, redirect_map, namespaces=None):
+        if namespaces is None:
+            namespaces = default_namespaces()
+        self.namespaces = namespaces  # Lower-case prefix -> (number, local prefix, case)
+        self.map = {}  # Canonical old title -> (new title, whether it needs a leading colon)
+        for old_title, new_title in redirect_map.items():
+            colon = self.canonical(new_title)[0] in self.skip_namespaces
+            self.map[self.canonical(old_title)[1]] = (new_title, colon)
+        self.cache = {}
+
+    def canonical(self, title):
+        """Return (namespace number, canonical title) of a link target."""
+        title = WHITESPACE_PATTERN.sub(" ", title).strip()
+        if title.startswith(":"):  # [[:Foo]] is the same page as [[Foo]]
+            title = title[1:].lstrip()
+        (number, prefix, case) = self.namespaces.get("", (0, "", 'first-letter'))
+        if ":" in title:
+            (name, rest) = title.split(":", 1)
+            namespace = self.namespaces.get(name.strip().lower())
+            if namespace is not None:
+                (number, prefix, case) = namespace
+                title = rest.strip()
+        if title and case == 'first-letter':
+            title = title[0].upper() + title[1:]
+        if number:
+            title = prefix + ":" + title
+        return (number, title)
+
+    def get(self, title, default=None):
+        try:
+            replacement = self.cache[title]
+        except KeyError:
+            (number, canonical) = self.canonical(title)
+            replacement = None
+            linked = title.lstrip().startswith(":")
+            if linked or number not in self.skip_namespaces:
+                new = self.map.get(canonical)
+                if new is not None:
+                    (replacement, colon) = new
+                    if linked or colon:
+                        replacement = ":" + replacement
+            if len(self.cache) >= self.max_cache:
+                self.cache.clear()
+            self.cache[title] = replacement
+        if replacement is None:
+            return default
+        return replacement
+
+
+def table_regions(text, table_templates):
+    """Return the sorted, merged spans of text where links may be fixed."""
+    spans = [table_match.span() for table_match in TABLE_PATTERN.finditer(text)]
+    for template in table_templates:
+        tablepos = 0
+        while True:
+            table_start = text.find(template, tablepos)
+            if(table_start == -1):
+                break
+            table_end = text.find("|}", table_start)
+            if(table_end == -1):  # Unterminated table runs to the end of the page
+                table_end = len(text)
+            spans.append((table_start, table_end))
+            tablepos = table_end
+
+    regions = []
+    for region_start, region_end in sorted(spans):
+        if regions and region_start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], region_end))
+        else:
+            regions.append((region_start, region_end))
+    return regions
+
+
+def rewrite_text(redirect_map, page_title, namespace, text, table_templates):
+    """Fix the links of one page and return (text, replaced, skipped).
+
+    Only plain strings go in and out, so pages can be rewritten in other
+    processes.
+    """
+    replaced = 0
+    skipped = 0
+
+    if(namespace == 0):
+        if(page_title.startswith("List of") or page_title.startswith("Channel")):
+            (replaced, text) = replace_links(redirect_map, text)
+        else:
+            chunks = []
+            copied = 0
+            for region_start, region_end in table_regions(text, table_templates):
+                (region_replaced, region_text) = replace_links(redirect_map, text[region_start:region_end])
+                chunks.append(text[copied:region_start])
+                chunks.append(region_text)
+                copied = region_end
+                replaced += region_replaced
+            if(replaced > 0):
+                chunks.append(text[copied:])
+                text = "".join(chunks)
+
+            skipped = replace_links(redirect_map, text, True)
+    else:
+        (replaced, text) = replace_links(redirect_map, text)
+    return (text, replaced, skipped)
+
+
+_rewrite_args = None  # (redirect_map, table_templates) of a rewrite worker process
+
+
+def _init_rewrite_worker(redirect_map, table_templates):
+    global _rewrite_args
+    _rewrite_args = (redirect_map, table_templates)
+
+
+def _rewrite_task(task):
+    (page_title, namespace, text) = task
+    (redirect_map, table_templates) = _rewrite_args
+    started = process_time()
+    result = rewrite_text(redirect_map, page_title, namespace, text, table_templates)
+    return (result, process_time() - started)
+
+
+class Rewriter(object):
+
+    """Rewrites batches of page texts, in a pool of processes if workers > 1.
+
+    The mapping is sent to each worker once, when the pool starts. Results
+    come back in the order of the batch. worker_cpu adds up the CPU time
+    the workers spent on them.
+    """
+
+    batch_size = 50  # pages handed to the pool at once
+
+    def __init__(self, redirect_map, table_templates, workers=1):
+        self.redirect_map = redirect_map
+        self.table_templates = table_templates
+        self.workers = workers
+        self.worker_cpu = 0.0
+        self.pool = None
+        if workers > 1:
+            self.pool = multiprocessing.Pool(workers, _init_rewrite_worker, (redirect_map, table_templates))
+
+    def rewrite(self, tasks):
+        """Return (text, replaced, skipped) for each (title, namespace, text) in tasks."""
+        if self.pool is None:
+            return [rewrite_text(self.redirect_map, page_title, namespace, text, self.table_templates)
+                    for (page_title, namespace, text) in tasks]
+        chunksize = max(1, len(tasks) // (self.workers * 4))
+        results = self.pool.map(_rewrite_task, tasks, chunksize)
+        self.worker_cpu += sum(cpu for (result, cpu) in results)
+        return [result for (result, cpu) in results]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+class RedirectFile(object):
 
-class LinkLog():
-    def __init__(self, file):
+    """The redirect pairs of a -redirectfile, checked before any network work.
+
+    Three formats are understood: Python tuples, one per line ("tuple"),
+    tab-separated titles ("tsv") and JSON Lines holding either a two item
+    list or an object with "old" and "new" keys ("jsonl"). The format is
+    guessed from the file extension unless given. A .json file is usually
+    a single JSON document, so its format has to be given.
+
+    Duplicate pairs are dropped. Chains such as A -> B and B -> C are
+    collapsed to A -> C and B -> C, and redirects caught in a cycle are
+    left out.
+    """
+
+    formats = ('tuple', 'tsv', 'jsonl')
+
+    def __init__(self, path, file_format=None):
+        self.path = path
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            if extension == '.tsv':
+                file_format = 'tsv'
+            elif extension in ('.jsonl', '.ndjson'):
+                file_format = 'jsonl'
+            elif extension == '.json':
+                raise ValueError("Cannot tell the format of %s. Give it with -redirectformat." % path)
+            else:
+                file_format = 'tuple'
+        self.file_format = file_format
+        self.pairs = None
+
+    def __iter__(self):
+        if self.pairs is None:
+            self.pairs = self.check(self.read())
+        return iter(self.pairs)
+
+    def parse_line(self, line):
+        """Return the (old, new) pair on a line, or None if it is malformed."""
+        if self.file_format == 'tsv':
+            fields = line.rstrip("\r\n").split("\t")
+        elif self.file_format == 'jsonl':
+            try:
+                fields = json.loads(line)
+            except ValueError:
+                return None
+            if isinstance(fields, dict):
+                fields = [fields.get('old'), fields.get('new')]
+        else:
+            match = TUPLE_LINE_PATTERN.match(line)
+            if match:  # Fast path for lines without escapes
+                fields = (match.group('old'), match.group('new'))
+            else:
+                try:
+                    fields = ast.literal_eval(line)
+                except (ValueError, SyntaxError):
+                    return None
+                if not isinstance(fields, tuple):
+                    return None
+        try:
+            (old_title, new_title) = [field.strip() for field in fields]
+        except (TypeError, ValueError, AttributeError):  # Not a pair of strings
+            return None
+        if not old_title or not new_title:
+            return None
+        return (old_title, new_title)
+
+    def read(self):
+        """Yield each pair in the file in order."""
+        with codecs.open(self.path, 'r', config.textfile_encoding) as f:
+            for line_number, line in enumerate(f, 1):
+                if(line.startswith("#") or not line.strip()):
+                    continue
+                pair = self.parse_line(line)
+                if pair is None:
+                    pywikibot.error("The redirect file contains an invalid line at line %s." % line_number)
+                else:
+                    yield pair
+
+    def check(self, pairs):
+        """Return pairs without duplicates, chains or cycles."""
+        order = []
+        mapping = {}
+        for old_title, new_title in pairs:
+            if old_title == new_title:
+                pywikibot.error("%s is renamed to itself. Skipping..." % old_title)
+            elif old_title not in mapping:
+                order.append(old_title)
+                mapping[old_title] = new_title
+            elif mapping[old_title] != new_title:
+                pywikibot.error("%s is renamed to both %s and %s. Using %s."
+                                % (old_title, mapping[old_title], new_title, mapping[old_title]))
+
+        checked = []
+        for old_title in order:
+            new_title = mapping[old_title]
+            seen = set([old_title])
+            while new_title in mapping and new_title not in seen:
+                seen.add(new_title)
+                new_title = mapping[new_title]
+            if new_title in seen:
+                pywikibot.error("%s is part of a cycle of renames. Skipping..." % old_title)
+                continue
+            if new_title != mapping[old_title]:
+                pywikibot.warning("%s -> %s is followed by another rename. Moving it to %s instead."
+                                  % (old_title, mapping[old_title], new_title))
+            checked.append((old_title, new_title))
+        return checked
+
+
+class JSONLinesWriter(object):
+
+    """Appends buffered records to a file as JSON lines.
+
+    Records are written out as soon as batch_size of them are waiting, and
+    by a daemon thread every flush_interval seconds, so a stalled run does
+    not keep them in memory. With sync, each write is fsync'd.
+    """
+
+    batch_size = 100
+
+    def __init__(self, file, flush_interval=5.0, sync=False):
+        self.file = file
+        self.flush_interval = flush_interval
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.pending = []
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.flush_periodically, name="flush %s" % file.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, event, **fields):
+        fields['event'] = event
+        line = json.dumps(fields) + "\n"
+        with self.lock:
+            self.pending.append(line)
+            if(len(self.pending) >= self.batch_size):
+                self._flush()
+
+    def _flush(self):
+        # called with the lock held
+        if not self.pending:
+            return
+        self.file.write("".join(self.pending))
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        self.pending = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+
+class LinkLog(object):
+
+    """Log of the redirects, link replacements and saves of a run.
+
+    Events are appended to file + ".jsonl" as JSON lines, written out
+    every flush_interval seconds or batch_size events (see
+    JSONLinesWriter). They are the only record of the run: the
+    human-readable summary in file is built from them when it ends.
+    """
+
+    def __init__(self, file, flush_interval=5.0):
         if os.path.exists(os.path.abspath(file)) and os.path.getsize(file) > 0:
             pywikibot.output("Link log exists. Log items will be appended.")
             self.log = codecs.open(os.path.abspath(file), 'a', 'utf-8')
@@ -65,86 +555,736 @@ class LinkLog():
             self.log.write("Started run on: " + time.strftime("%c"))
             self.log.write("\n\n----------------------------------------"
                            + "\nRedirects:")
-        self.replaced = {}
-        self.skipped = {}
+        self.events_path = os.path.abspath(file) + ".jsonl"
+        self.events_start = 0  # Offset of the first event of this run
+        if os.path.exists(self.events_path):
+            self.events_start = os.path.getsize(self.events_path)
+        self.events = JSONLinesWriter(open(self.events_path, 'a'), flush_interval)
+
+    def record(self, event, **fields):
+        self.events.record(event, **fields)
 
     def new_redirect(self, old_redirect, new_redirect, target):
-        self.log.write(u"\n" + old_redirect + u" -> " + new_redirect + u" => " + target)
+        self.record('redirect', old=old_redirect, new=new_redirect, target=target)
+
+    def count_links(self, page_title, replaced, skipped):
+        self.record('page', title=page_title, replaced=replaced, skipped=skipped)
+
+    def save_result(self, page_title, state):
+        self.record('save', title=page_title, state=state)
+
+    def read_events(self):
+        """Yield the events of this run from the JSON lines file."""
+        with open(self.events_path) as events:
+            events.seek(self.events_start)
+            for line in events:
+                try:
+                    yield json.loads(line)
+                except ValueError:  # Torn line of an earlier run that was killed
+                    continue
+
+    def summary(self):
+        """Return the Redirects list and the Skipped, Replaced and Saves sections."""
+        redirects = []
+        counts = {'replaced': {}, 'skipped': {}}  # Page title -> links, per kind
+        order = {'replaced': [], 'skipped': []}  # Page titles in the order they were logged
+        saves = {}
+        save_order = []
+        for event in self.read_events():
+            if event['event'] == 'redirect':
+                redirects.append(u"\n" + event['old'] + u" -> " + event['new'] + u" => " + event['target'])
+            elif event['event'] == 'page':
+                for kind in ('replaced', 'skipped'):
+                    if event[kind] > 0:
+                        if event['title'] not in counts[kind]:
+                            order[kind].append(event['title'])
+                            counts[kind][event['title']] = 0
+                        counts[kind][event['title']] += event[kind]
+            elif event['event'] == 'save':
+                if event['title'] not in saves:
+                    save_order.append(event['title'])
+                saves[event['title']] = event['state']
+
+        lines = redirects
+        lines.append("\n\n----------------------------------------"
+                     + "\nSkipped:")
+        for page_title in order['skipped']:
+            lines.append(u"\n" + page_title + u":"
+                         u"\n    " + str(counts['skipped'][page_title]) + u" link(s) skipped")
+        lines.append("\n\n----------------------------------------"
+                     + "\nReplaced:")
+        for page_title in order['replaced']:
+            lines.append(u"\n" + page_title + u":"
+                         u"\n    " + str(counts['replaced'][page_title]) + u" link(s) replaced")
+        lines.append("\n\n----------------------------------------"
+                     + "\nSaves:")
+        for page_title in save_order:
+            lines.append(u"\n" + page_title + u": " + saves[page_title])
+        return "".join(lines)
 
     def save(self):
-        self.log.write("\n\n----------------------------------------"
-                       + "\nSkipped:")
-        for page_title, count in self.skipped.iteritems():
-            self.log.write(u"\n" + page_title + u":"
-                           u"\n    " + str(count) + u" link(s) skipped")
-        self.log.write("\n\n----------------------------------------"
-                       + "\nReplaced:")
-        for page_title, count in self.replaced.iteritems():
-            self.log.write(u"\n" + page_title + u":"
-                           u"\n    " + str(count) + u" link(s) replaced")
+        self.events.close()
+        self.log.write(self.summary())
         self.log.write("\n\n----------------------------------------"
                        + "\nFinished run on: " + time.strftime("%c") + "\n")
         self.log.close()
 
 
+class Prefetcher(object):
+
+    """Batched API lookups done before any page is rewritten."""
+
+    def __init__(self, site, batch_size=None):
+        self.site = site
+        self._batch_size = batch_size
+        self.api_calls = 0
+        self.redirect_targets = {}  # Redirect title -> target title
+        self.missing = set()
+        self.existing = set()  # Titles of existing non-redirect pages
+        self.normalized = {}
+
+    @property
+    def batch_size(self):
+        if self._batch_size is None:
+            if self.site.logged_in() and self.site.has_right('apihighlimits'):
+                self._batch_size = 500
+            else:
+                self._batch_size = 50
+        return self._batch_size
+
+    def query(self, **params):
+        """Yield the query part of each result, following continuations."""
+        params['action'] = 'query'
+        params['rawcontinue'] = ""  # Ask for query-continue on wikis that default to continue
+        while True:
+            self.api_calls += 1
+            result = api.Request(site=self.site, **params).submit()
+            yield result.get('query', {})
+            if 'query-continue' in result:
+                for continue_params in result['query-continue'].values():
+                    params.update(continue_params)
+            elif 'continue' in result:  # rawcontinue was not understood
+                params.pop('rawcontinue', None)
+                params.update(result['continue'])
+            else:
+                break
+
+    def resolve_redirects(self, titles):
+        """Look up the existence and redirect targets of titles in bulk."""
+        for batch in itergroup(sorted(set(titles)), self.batch_size):
+            for query in self.query(titles="|".join(batch), redirects=""):
+                for item in query.get('normalized', []):
+                    self.normalized[item['from']] = item['to']
+                for item in query.get('redirects', []):
+                    target = item['to']
+                    if item.get('tofragment'):
+                        target += "#" + item['tofragment']
+                    self.redirect_targets[item['from']] = target
+                for page_data in query.get('pages', {}).values():
+                    if 'missing' in page_data:
+                        self.missing.add(page_data['title'])
+                    elif 'invalid' not in page_data:
+                        self.existing.add(page_data['title'])
+
+    def is_known(self, title):
+        title = self.normalized.get(title, title)
+        return (title in self.redirect_targets or title in self.missing
+                or title in self.existing)
+
+    def redirect_target(self, page):
+        """Return the prefetched redirect target of page.
+
+        Raises the same exceptions as Page.getRedirectTarget.
+        """
+        title = page.title()
+        title = self.normalized.get(title, title)
+        if title not in self.redirect_targets:
+            raise pywikibot.IsNotRedirectPage(page)
+        seen = set([title])
+        target = self.redirect_targets[title]
+        while target in self.redirect_targets:  # Walk the chain to catch loops
+            if target in seen:
+                raise pywikibot.CircularRedirect(page)
+            seen.add(target)
+            target = self.redirect_targets[target]
+        return pywikibot.Page(self.site, self.redirect_targets[title])
+
+    def check_exists(self, page):
+        """Raise NoPage if page is known not to exist."""
+        title = page.title()
+        if self.normalized.get(title, title) in self.missing:
+            raise pywikibot.NoPage(page)
+
+    def backlinks(self, titles):
+        """Yield each page linking to any of titles exactly once."""
+        seen = set()
+        for batch in itergroup(sorted(set(titles)), self.batch_size):
+            for query in self.query(prop='linkshere', titles="|".join(batch),
+                                    lhprop='title', lhlimit='max'):
+                for page_data in query.get('pages', {}).values():
+                    for link in page_data.get('linkshere', []):
+                        if link['title'] not in seen:
+                            seen.add(link['title'])
+                            yield pywikibot.Page(self.site, link['title'], ns=link['ns'])
+
+    def preload(self, pages):
+        """Load the contents of pages in bulk, batch_size pages per request."""
+        for batch in itergroup(pages, self.batch_size):
+            self.api_calls += 1
+            for page in self.site.preloadpages(batch, groupsize=len(batch)):
+                yield page
+
+
+class Journal(object):
+
+    """Append-only record of finished work, read back by -resume.
+
+    Records are buffered and written out, then fsync'd, every
+    flush_interval seconds or batch_size records, whichever comes first
+    (see JSONLinesWriter).
+    """
+
+    def __init__(self, path, resume=False, flush_interval=5.0):
+        self.path = os.path.abspath(path)
+        self.redirects = {}  # Old title -> new title, None if init failed
+        self.rewritten = {}  # Page title -> whether the text changed
+        self.saved = {}  # Page title -> final save state
+        if resume:
+            self.load()
+            pywikibot.output("Resuming from %s: %d redirects, %d pages rewritten, %d pages saved."
+                             % (path, len(self.redirects), len(self.rewritten), len(self.saved)))
+        journal_file = open(self.path, 'a' if resume else 'w')
+        if journal_file.tell() > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read() != b"\n":  # Do not glue new records onto a torn line
+                    journal_file.write("\n")
+        self.writer = JSONLinesWriter(journal_file, flush_interval, sync=True)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # Torn last line of a killed run
+                    continue
+                if record['event'] == 'redirect':
+                    self.redirects[record['old']] = record['new'] if record['ok'] else None
+                elif record['event'] == 'rewrite':
+                    self.rewritten[record['title']] = record['changed']
+                elif record['event'] == 'save':
+                    self.saved[record['title']] = record['state']
+
+    def done(self, page_title):
+        """Return whether nothing is left to do for a page."""
+        return page_title in self.saved or self.rewritten.get(page_title) is False
+
+    def record(self, event, **fields):
+        self.writer.record(event, **fields)
+
+    def close(self):
+        self.writer.close()
+
+
+class PhaseProfiler(object):
+
+    """Time spent in each phase of a run, API calls and wikitext processed.
+
+    Time spent in a phase nested in another one (fetching backlinks while
+    preloading pages) only counts for the inner phase. Phases timed in the
+    save threads are summed over the threads. cProfile, if a stats file is
+    given, only sees the main thread.
+
+    Besides the wall-clock time, the CPU time of the cpu_phases is
+    recorded: that of this process during the phase plus what add_cpu
+    reports for the rewrite workers.
+    """
+
+    phases = ('init_redirects', 'backlinks', 'fetch', 'fix_links', 'showDiff', 'save')
+    cpu_phases = ('fix_links',)
+
+    def __init__(self, enabled=False, stats_file=None):
+        self.enabled = enabled
+        self.stats_file = stats_file
+        self.times = dict.fromkeys(self.phases, 0.0)
+        self.cpu_times = dict.fromkeys(self.cpu_phases, 0.0)
+        self.calls = dict.fromkeys(self.phases, 0)
+        self.api_calls = {}  # action -> number of requests
+        self.text_bytes = 0  # UTF-8 size of the wikitext given to fix_links
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profile = None
+        self.started = None
+        self.elapsed = None
+        self._submit = None
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        stack = self.local.__dict__.setdefault('stack', [])
+        frame = [time.time(), 0.0]  # start, time of nested phases
+        stack.append(frame)
+        cpu_started = process_time() if name in self.cpu_times else None
+        try:
+            yield
+        finally:
+            elapsed = time.time() - frame[0]
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            with self.lock:
+                self.times[name] += elapsed - frame[1]
+                self.calls[name] += 1
+                if cpu_started is not None:
+                    self.cpu_times[name] += process_time() - cpu_started
+
+    def add_cpu(self, name, seconds):
+        """Count CPU time spent on phase name in other processes."""
+        if self.enabled:
+            with self.lock:
+                self.cpu_times[name] += seconds
+
+    def timed(self, name, iterable):
+        """Yield from iterable, timing each step as phase name."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count_text(self, texts):
+        if self.enabled:
+            self.text_bytes += sum(len(text.encode('utf-8')) for text in texts)
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.started = time.time()
+        self._submit = api.Request.submit
+        profiler = self
+        submit = self._submit
+
+        def counted_submit(request):
+            with profiler.lock:
+                profiler.api_calls[request.action] = profiler.api_calls.get(request.action, 0) + 1
+            return submit(request)
+        api.Request.submit = counted_submit
+        if self.stats_file:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.elapsed = time.time() - self.started
+        api.Request.submit = self._submit
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.stats_file)
+
+    def report(self):
+        if not self.enabled:
+            return
+        lines = ["\n%-16s %8s %10s %10s %7s" % ("Phase", "Calls", "Wall s", "CPU s", "Run %")]
+        for name in self.phases:
+            if name in self.cpu_times:
+                cpu = "%10.2f" % self.cpu_times[name]
+            else:
+                cpu = "%10s" % "-"
+            lines.append("%-16s %8d %10.2f %s %6.1f%%"
+                         % (name, self.calls[name], self.times[name], cpu, 100 * self.times[name] / self.elapsed))
+        lines.append("%-16s %8s %10.2f" % ("total run", "", self.elapsed))
+        lines.append("Wall s is elapsed time, CPU s the CPU time of the phase including the rewrite workers.")
+        megabytes = self.text_bytes / 1e6
+        lines.append("\nWikitext processed: %.2f MB" % megabytes)
+        if self.times['fix_links']:
+            lines.append("fix_links throughput: %.2f MB/s of wall time" % (megabytes / self.times['fix_links']))
+        lines.append("API calls: %d (%s)" % (sum(self.api_calls.values()), ", ".join(
+            "%s %d" % (action, count) for action, count in sorted(self.api_calls.items()))))
+        if self.stats_file:
+            lines.append("cProfile statistics written to %s" % self.stats_file)
+        pywikibot.output("\n".join(lines))
+
+
+class MemoryPageStore(object):
+
+    """Keeps rewritten pages in memory until they are saved."""
+
+    def __init__(self):
+        self.pages = {}
+
+    def add(self, page, original_text):
+        self.pages[page.title()] = (original_text, page)
+
+    def titles(self):
+        return list(self.pages)
+
+    def load(self, page_title):
+        return self.pages[page_title]
+
+    def discard(self, page_title):
+        self.pages.pop(page_title, None)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLitePageStore(object):
+
+    """Keeps the original and rewritten text of pages in an SQLite file.
+
+    Page objects are not kept: a fresh one is loaded when the page is due to
+    be saved. If the page was edited after it was rewritten, load returns
+    (None, None) and the replacements have to be redone. Added and
+    discarded pages are committed by flush, once per batch of rewritten
+    pages, and by close.
+    """
+
+    def __init__(self, site, path, resume=False):
+        self.site = site
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.abspath(path), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages "
+                        "(title TEXT PRIMARY KEY, revid INTEGER, original TEXT, text TEXT)")
+        if not resume:
+            self.db.execute("DELETE FROM pages")
+        self.db.commit()
+
+    def titles(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT title FROM pages")]
+
+    def add(self, page, original_text):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                            (page.title(), page.latest_revision_id, original_text, page.text))
+
+    def load(self, page_title):
+        with self.lock:
+            (revid, original_text, text) = self.db.execute(
+                "SELECT revid, original, text FROM pages WHERE title = ?", (page_title,)).fetchone()
+        page = pywikibot.Page(self.site, page_title)
+        page.get()
+        if page.latest_revision_id != revid:
+            return (None, None)
+        page.text = text
+        return (original_text, page)
+
+    def discard(self, page_title):
+        with self.lock:
+            self.db.execute("DELETE FROM pages WHERE title = ?", (page_title,))
+
+    def flush(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def dump_changes(dump_file, rewriter):
+    """Yield (entry, text, replaced, skipped) for dump pages linking to an old redirect.
+
+    The dump is streamed, so memory use does not grow with its size.
+    """
+    dump = xmlreader.XmlDump(dump_file)
+    for entries in itergroup(dump.parse(), rewriter.batch_size):
+        results = rewriter.rewrite([(entry.title, int(entry.ns), entry.text) for entry in entries])
+        for entry, (text, replaced, skipped) in zip(entries, results):
+            if replaced or skipped:
+                yield (entry, text, replaced, skipped)
+
+
+class DumpPreview(object):
+
+    """Writes the changes a run would make to the pages of a dump as a patch.
+
+    Nothing is fetched from or saved to the wiki, so the redirects are
+    used as given instead of being checked and created.
+    """
+
+    def __init__(self, redirect_titles, link_log, dump_file, patch_file, table_templates=None, rewrite_workers=1):
+        self.redirect_map = TitleIndex(dict(redirect_titles))
+        self.link_log = link_log
+        self.dump_file = dump_file
+        self.patch_file = patch_file
+        self.table_templates = tuple(table_templates or RedirectBot.table_templates)
+        self.rewrite_workers = rewrite_workers
+
+    def run(self):
+        rewriter = Rewriter(self.redirect_map, self.table_templates, self.rewrite_workers)
+        changed = 0
+        replaced_links = 0
+        with codecs.open(self.patch_file, 'w', 'utf-8') as patch:
+            for entry, text, replaced, skipped in dump_changes(self.dump_file, rewriter):
+                self.link_log.count_links(entry.title, replaced, skipped)
+                pywikibot.output("%s: %d link(s) to replace, %d skipped" % (entry.title, replaced, skipped))
+                if text != entry.text:
+                    changed += 1
+                    replaced_links += replaced
+                    for line in difflib.unified_diff(entry.text.splitlines(True), text.splitlines(True),
+                                                     "a/" + entry.title, "b/" + entry.title):
+                        if not line.endswith("\n"):
+                            line += "\n\\ No newline at end of file\n"
+                        patch.write(line)
+        rewriter.close()
+        pywikibot.output("\n%d page(s) in %s would change, %d link(s) replaced. Patch written to %s."
+                         % (changed, self.dump_file, replaced_links, self.patch_file))
+
+
+class SaveTask(object):
+
+    """A page waiting to be saved and the state its save has reached."""
+
+    PENDING = 'pending'
+    CONFLICT = 'edit conflict'
+    SAVED = 'saved'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+    def __init__(self, title):
+        self.title = title
+        self.original_text = None
+        self.page = None
+        self.state = SaveTask.PENDING
+        self.tries = 0
+        self.lag_tries = 0
+
+
+class EditThrottle(object):
+
+    """Spaces edits from all save workers out to an edits-per-minute budget."""
+
+    def __init__(self, edits_per_minute=None):
+        if edits_per_minute:
+            self.interval = 60.0 / edits_per_minute
+        else:
+            self.interval = 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def back_off(self, delay):
+        """Hold back every worker for at least delay seconds."""
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.time() + delay)
+
+
+class SavePipeline(object):
+
+    """Saves pages with a bounded pool of worker threads.
+
+    Edit conflicts and server lag do not block a worker: the task is put
+    back on the queue and picked up again later. pywikibot's own put
+    throttle (-pt) still applies on top of edits_per_minute.
+    """
+
+    max_tries = 3
+    max_lag_tries = 5
+    lag_delay = 30
+
+    def __init__(self, bot, redirect_map, workers=1, edits_per_minute=None):
+        self.bot = bot
+        self.redirect_map = redirect_map
+        self.throttle = EditThrottle(edits_per_minute)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        for worker in range(max(workers, 1)):
+            thread = threading.Thread(target=self.work, name="save-%d" % worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, task):
+        self.queue.put(task)
+
+    def join(self):
+        self.queue.join()
+
+    def close(self):
+        """Stop the worker threads once the queued tasks are done."""
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                self.queue.task_done()
+                return
+            try:
+                self.step(task)
+            except Exception as error:
+                pywikibot.error("Saving %s failed: %s" % (task.title, error))
+                self.finish(task, SaveTask.FAILED)
+            finally:
+                self.queue.task_done()
+
+    def finish(self, task, state):
+        revid = None
+        if state == SaveTask.SAVED:
+            revid = task.page.latest_revision_id
+        task.state = state
+        task.original_text = None
+        task.page = None
+        self.bot.page_store.discard(task.title)
+        if self.bot.journal is not None:
+            self.bot.journal.record('save', title=task.title, state=state, revid=revid)
+        if state == SaveTask.SAVED:
+            with self.lock:
+                self.bot.saved_pages += 1
+        self.bot.link_log.save_result(task.title, state)
+
+    def step(self, task):
+        """Move task on by one transition, requeueing it if it needs more."""
+        if task.state == SaveTask.PENDING and task.page is None:
+            (task.original_text, task.page) = self.bot.page_store.load(task.title)
+            if task.page is None:
+                pywikibot.output("%s was edited after it was rewritten. Redoing the replacements..." % task.title)
+                task.state = SaveTask.CONFLICT
+        if task.state == SaveTask.CONFLICT:
+            task.page = pywikibot.Page(self.bot.site, task.title)  # Reload the page and redo the replacements
+            task.original_text = task.page.text
+            # The links of the page were logged when it was first rewritten
+            (task.page.text, replaced, skipped) = rewrite_text(self.redirect_map, task.title, task.page.namespace(),
+                                                               task.original_text, self.bot.table_templates)
+            if task.original_text == task.page.text:
+                return self.finish(task, SaveTask.SKIPPED)
+            with self.bot.profiler.phase('showDiff'):
+                pywikibot.showDiff(task.original_text, task.page.text)
+
+        page = task.page
+        if not page.botMayEdit():  # Explicit call just to be safe
+            pywikibot.error("Editing by bots restricted on %s." % task.title)
+            return self.finish(task, SaveTask.SKIPPED)
+        if not page.canBeEdited():
+            pywikibot.error("Editing protected on %s." % task.title)
+            return self.finish(task, SaveTask.SKIPPED)
+
+        task.tries += 1
+        self.throttle.wait()
+        try:
+            with self.bot.profiler.phase('save'):
+                page.save(self.bot.summary)
+        except pywikibot.EditConflict:
+            if(task.tries < self.max_tries):
+                pywikibot.error("An edit conflict has occurred at %s. Retrying..." % page.title(asLink=True))
+                task.state = SaveTask.CONFLICT
+                self.queue.put(task)
+            else:
+                pywikibot.output("An edit conflict has occurred at %s more than %d times. Skipping..."
+                                 % (page.title(asLink=True), self.max_tries))
+                self.finish(task, SaveTask.FAILED)
+        except pywikibot.OtherPageSaveError as error:
+            lagged = (isinstance(error.reason, (api.TimeoutError, pywikibot.ServerError))
+                      or getattr(error.reason, 'code', None) == 'maxlag')
+            if not lagged or task.lag_tries >= self.max_lag_tries:
+                raise
+            task.tries -= 1
+            task.lag_tries += 1
+            delay = self.lag_delay * 2 ** (task.lag_tries - 1)
+            pywikibot.warning("Server is lagging, holding back saves for %d seconds." % delay)
+            self.throttle.back_off(delay)
+            self.queue.put(task)
+        else:
+            self.finish(task, SaveTask.SAVED)
+
+
 class RedirectBot(Bot):
-    def __init__(self, summary, redirect_titles, fix_double_redirects, link_log, gen_factory, **kwargs):
+    table_templates = ("{{Mexico TV station table/top}}", "{{Mexico TV station table/top2}}")
+
+    def __init__(self, summary, redirect_titles, fix_double_redirects, link_log, gen_factory, table_templates=None,
+                 save_workers=1, edits_per_minute=None, page_store=None, journal=None, rewrite_workers=1,
+                 profiler=None, dump_file=None, **kwargs):
         super(RedirectBot, self).__init__(**kwargs)
         self.site = pywikibot.Site()
         if summary:
             self.summary = summary
         else:
             self.summary = u"Fix link to old redirect after redirect was moved"
-        self.redirects = []
-        for old_redirect_title, new_redirect_title in redirect_titles:
-            self.redirects.append((pywikibot.Page(self.site, old_redirect_title),
-                                   pywikibot.Page(self.site, new_redirect_title)))
+        self.redirect_titles = redirect_titles
         self.fix_double_redirects = fix_double_redirects
         self.link_log = link_log
         self.gen_factory = gen_factory
-        self.page_list = {}
+        if table_templates:
+            self.table_templates = tuple(table_templates)
+        self.prefetcher = Prefetcher(self.site)
+        if page_store is None:
+            page_store = MemoryPageStore()
+        self.page_store = page_store
+        self.journal = journal
+        self.save_workers = save_workers
+        self.edits_per_minute = edits_per_minute
+        self.rewrite_workers = rewrite_workers
+        if profiler is None:
+            profiler = PhaseProfiler()
+        self.profiler = profiler
+        self.dump_file = dump_file
         self.saved_pages = 0
 
     def init_redirects(self, old_redirect, new_redirect, fail_creation_conflict=False):
         try:  # Verify redirect target
-            destination = old_redirect.getRedirectTarget()
+            destination = self.redirect_target(old_redirect)
         except pywikibot.IsNotRedirectPage:
             pywikibot.error(u"%s is not a redirect." % old_redirect.title())
-            return
+            return False
         except pywikibot.CircularRedirect:
             pywikibot.error(u'%s points to a circular redirect.' % old_redirect.title())
-            return
+            return False
         except pywikibot.NoPage:
             pywikibot.error(u"%s doesn't exist." % old_redirect.title())
-            return
+            return False
 
         pywikibot.output("%s was found. Proceeding..." % old_redirect.title())
         pywikibot.output("Target: %s" % destination.title())
 
         if(self.fix_double_redirects):
             try:  # Handle double redirects
-                destination = destination.getRedirectTarget()
+                destination = self.redirect_target(destination)
                 pywikibot.output(u"%s points to another redirect. Going to resolve the double redirect." % old_redirect.title())
                 try:
-                    destination.get()
+                    self.check_exists(destination)
                 except pywikibot.NoPage:
                     pywikibot.error(u"%s points to a redirect that points to a non-existent page!" % old_redirect.title())
-                    return
+                    return False
             except pywikibot.IsNotRedirectPage:
                 pass
 
         try:  # Handle new redirect
-            new_redirect_target = new_redirect.getRedirectTarget().title()
+            new_redirect_target = self.redirect_target(new_redirect).title()
             if(new_redirect_target == destination.title()):
                 pywikibot.output(u"%s is a redirect and already points to the correct target." % new_redirect.title())
             else:
                 pywikibot.error(u"%s is a redirect but doesn't point to the correct target!" % new_redirect.title())
-                return
+                return False
         except pywikibot.IsNotRedirectPage:
             try:
-                new_redirect.get()
+                self.check_exists(new_redirect)
                 pywikibot.error(u"%s exists and isn't a redirect!" % new_redirect.title())
-                return
+                return False
             except pywikibot.NoPage:
                 pywikibot.output(u"%s doesn't exist. Creating it now..." % new_redirect.title())
                 old_text = new_redirect.text
@@ -157,160 +1297,143 @@ class RedirectBot(Bot):
                 except pywikibot.PageCreatedConflict:
                     if fail_creation_conflict:
                         pywikibot.error("A page creation conflict has occurred at %s. Failing..." % new_redirect.title())
-                        return
+                        return False
                     else:
                         pywikibot.error("A page creation conflict has occured at %s. Retrying..." % new_redirect.title())
-                        self.init_redirects(old_redirect, new_redirect, fail_creation_conflict=True)
+                        return self.init_redirects(old_redirect, new_redirect, fail_creation_conflict=True)
         self.link_log.new_redirect(old_redirect.title(), new_redirect.title(), destination.title())
+        return True
 
-    def replace_links(self, to_replace, replacement, text, dry=False):
-        replaced = 0
-        old_text = text
-        link_pattern = re.compile(
-            r'(?<=\[\[)(?P<title>.*?)(?:#(?P<section>.*?))?(?:\|.*?)?(?=\]\])')
-        curpos = 0
+    def redirect_target(self, page):
+        if self.prefetcher.is_known(page.title()):
+            return self.prefetcher.redirect_target(page)
+        return page.getRedirectTarget()
 
-        while True:
-            match = link_pattern.search(text, pos=curpos)
-            if not match:
-                break
-            if not match.group('title').strip():
-                curpos = match.end()
-                continue
-            title = match.group('title')
-            if title.startswith("File:") or title.startswith("Category:"):
-                curpos = match.end('title')
-                continue
-            if title == to_replace:
-                replaced += 1
-                text = text[0:match.start('title')] + replacement + text[match.end('title'):len(text)]
-                curpos = match.end('title') + (len(text) - len(old_text))
-            curpos = match.end('title')
-        if dry:
-            return replaced
-        else:
-            return (replaced, text)
-
-    def fix_links(self, old_redirect, new_redirect, page):
-        replaced = 0
-        skipped = 0
-        old_text = page.text
-        table = re.compile(
-            r'\{\|.*\|\}', flags=re.S)
-
-        if(page.namespace() == 0):
-            if(page.title().startswith("List of") or page.title().startswith("Channel")):
-                (replaced, page.text) = self.replace_links(old_redirect.title(), new_redirect.title(), page.text)
-                if(replaced > 0):
-                    try:
-                        self.link_log.replaced[page.title()] += replaced
-                    except KeyError:
-                        self.link_log.replaced[page.title()] = replaced
-            else:
-                tablepos = 0
-                while True:
-                    table_match = table.search(page.text, pos=tablepos)
-                    if not table_match:
-                        break
-                    table_text = table_match.group(0)
-                    (table_replaced, table_text) = self.replace_links(old_redirect.title(), new_redirect.title(), table_text)
-                    page.text = page.text[0:table_match.start()] + table_text + page.text[table_match.end():len(page.text)]
-                    tablepos = table_match.end() + (len(page.text) - len(old_text))
-                    replaced += table_replaced
-
-                tablepos = 0
-                while True:
-                    table_match = page.text.find("{{Mexico TV station table/top}}", tablepos)
-                    table_match_end = page.text.find("|}", table_match)
-                    if(table_match == -1):
-                        break
-                    table_text = page.text[table_match:table_match_end]
-                    (table_replaced, table_text) = self.replace_links(old_redirect.title(), new_redirect.title(), table_text)
-                    page.text = page.text[0:table_match] + table_text + page.text[table_match_end:len(page.text)]
-                    tablepos = table_match_end + (len(page.text) - len(old_text))
-                    replaced += table_replaced
-
-                tablepos = 0
-                while True:
-                    table_match = page.text.find("{{Mexico TV station table/top2}}", tablepos)
-                    table_match_end = page.text.find("|}", table_match)
-                    if(table_match == -1):
-                        break
-                    table_text = page.text[table_match:table_match_end]
-                    (table_replaced, table_text) = self.replace_links(old_redirect.title(), new_redirect.title(), table_text)
-                    page.text = page.text[0:table_match] + table_text + page.text[table_match_end:len(page.text)]
-                    tablepos = table_match_end + (len(page.text) - len(old_text))
-                    replaced += table_replaced
-
-                skipped = self.replace_links(old_redirect.title(), new_redirect.title(), page.text, True)
-                if(replaced > 0):
-                    try:
-                        self.link_log.replaced[page.title()] += replaced
-                    except KeyError:
-                        self.link_log.replaced[page.title()] = replaced
-                if(skipped > 0):
-                    try:
-                        self.link_log.skipped[page.title()] += skipped
-                    except KeyError:
-                        self.link_log.skipped[page.title()] = skipped
+    def check_exists(self, page):
+        if self.prefetcher.is_known(page.title()):
+            self.prefetcher.check_exists(page)
         else:
-            (replaced, page.text) = self.replace_links(old_redirect.title(), new_redirect.title(), page.text)
-            if(replaced > 0):
-                try:
-                    self.link_log.replaced[page.title()] += replaced
-                except KeyError:
-                    self.link_log.replaced[page.title()] = replaced
+            page.get()
 
-    def run(self):
-        for old_redirect, new_redirect in self.redirects:
-            pywikibot.output("\nMoving %s to %s." % (old_redirect.title(), new_redirect.title()))
-            self.init_redirects(old_redirect, new_redirect)
-            generator = self.gen_factory.getCombinedGenerator(gen=old_redirect.getReferences(content=True))
-            pywikibot.output("Checking for eligible links for replacement")
-            for page in generator:
-                pywikibot.output("Checking: %s" % page.title())
-                try:
-                    self.fix_links(old_redirect, new_redirect, self.page_list[page.title()][1])
-                except KeyError:
-                    self.page_list[page.title()] = (page.text, page)  # Save old page text in tuple, page will be mutated by fix_links
-                    self.fix_links(old_redirect, new_redirect, self.page_list[page.title()][1])
+    def redirect_pages(self):
+        """Yield (old, new) Page pairs for redirects still to be initialised."""
+        for old_title, new_title in self.redirect_titles:
+            old_redirect = pywikibot.Page(self.site, old_title)
+            if self.journal is not None and old_redirect.title() in self.journal.redirects:
+                continue  # Initialised by the interrupted run
+            yield (old_redirect, pywikibot.Page(self.site, new_title))
 
-        for page_title, (original_text, page) in self.page_list.iteritems():
-            if(original_text == page.text):
-                continue
+    def unfinished_pages(self, generator, resumed):
+        """Leave out pages taken from the page store or finished by the interrupted run."""
+        for page in generator:
+            page_title = page.title()
+            if page_title not in resumed and (self.journal is None or not self.journal.done(page_title)):
+                yield page
 
-            pywikibot.output("Saving: %s" % page.title())
-            edit_try = 1
-            while(edit_try <= 3):
-                pywikibot.showDiff(original_text, page.text)
-                if not page.botMayEdit():  # Explicit call just to be safe
-                    pywikibot.error("Editing by bots restricted on %s." % page.title())
-                if not page.canBeEdited():
-                    pywikibot.error("Editing protected on %s." % page.title())
+    def run(self):
+        journal = self.journal
+        profiler = self.profiler
+        profiler.start()
+        try:
+            titles = []
+            for old_redirect, new_redirect in self.redirect_pages():
+                titles.append(old_redirect.title())
+                titles.append(new_redirect.title())
+            with profiler.phase('init_redirects'):
+                self.prefetcher.resolve_redirects(titles)
+            # Intermediate redirects of double redirects are resolved in the same
+            # batches, so init_redirects can run without further lookups.
 
-                try:
-                    self.saved_pages += 1
-                    page.save(self.summary)
-                    break
-                except pywikibot.EditConflict:
-                    if(edit_try < 3):
-                        pywikibot.error("An edit conflict has occurred at %s. Retrying..." % page.title(asLink=True))
-                        edit_try += 1
-                        self.fix_links(old_redirect, new_redirect, self.page_list[page.title()][1])
-                        original_text = self.page_list[0]
-                        page = self.page_list[1]
-                    else:
-                        pywikibot.output("An edit conflict has occurred at %s more than 3 times. Skipping..." % page.title(asLink=True))
-                        break
-        pywikibot.output("\nPages saved: " + str(self.saved_pages))
+            redirect_map = {}
+            if journal is not None:
+                for old_title, new_title in journal.redirects.items():
+                    if new_title is not None:
+                        redirect_map[old_title] = new_title
+            for old_redirect, new_redirect in self.redirect_pages():
+                old_title = old_redirect.title()
+                new_title = new_redirect.title()
+                pywikibot.output("\nMoving %s to %s." % (old_title, new_title))
+                with profiler.phase('init_redirects'):
+                    initialized = self.init_redirects(old_redirect, new_redirect)
+                if initialized:
+                    redirect_map[old_title] = new_title
+                if journal is not None:
+                    journal.record('redirect', old=old_title, new=new_title, ok=initialized)
+
+            # Every page is rewritten once against the whole mapping, no matter
+            # how many of the old redirects it links to, and is handed to the
+            # save workers straight away. Links are matched by their canonical
+            # title. The rewrite pool is started before the save threads so that
+            # its processes are not forked from them.
+            title_index = TitleIndex(redirect_map, site_namespaces(self.site))
+            rewriter = Rewriter(title_index, self.table_templates, self.rewrite_workers)
+            pipeline = SavePipeline(self, title_index, self.save_workers, self.edits_per_minute)
+            resumed = set(self.page_store.titles())  # Only a persistent store survives a restart
+            for page_title in resumed:
+                pipeline.put(SaveTask(page_title))
+            pywikibot.output("\nChecking for eligible links for replacement")
+            if self.dump_file:  # Only pages that change in the dump are fetched
+                backlinks = (pywikibot.Page(self.site, entry.title)
+                             for entry, text, replaced, skipped in dump_changes(self.dump_file, rewriter)
+                             if text != entry.text)
+            else:
+                backlinks = self.prefetcher.backlinks(redirect_map)
+            generator = self.gen_factory.getCombinedGenerator(gen=profiler.timed('backlinks', backlinks))
+            if resumed or journal is not None:
+                generator = self.unfinished_pages(generator, resumed)
+            for pages in itergroup(profiler.timed('fetch', self.prefetcher.preload(generator)), rewriter.batch_size):
+                tasks = [(page.title(), page.namespace(), page.text) for page in pages]
+                profiler.count_text(text for (page_title, namespace, text) in tasks)
+                worker_cpu = rewriter.worker_cpu
+                with profiler.phase('fix_links'):
+                    results = rewriter.rewrite(tasks)
+                profiler.add_cpu('fix_links', rewriter.worker_cpu - worker_cpu)
+                for page, (page_title, namespace, original_text), (text, replaced, skipped) in zip(pages, tasks, results):
+                    pywikibot.output("Checking: %s" % page_title)
+                    self.link_log.count_links(page_title, replaced, skipped)
+                    changed = original_text != text
+                    if changed:
+                        page.text = text
+                        pywikibot.output("Saving: %s" % page_title)
+                        with profiler.phase('showDiff'):
+                            pywikibot.showDiff(original_text, page.text)
+                        self.page_store.add(page, original_text)
+                        pipeline.put(SaveTask(page_title))
+                    if journal is not None:
+                        journal.record('rewrite', title=page_title, changed=changed)
+                self.page_store.flush()
+            rewriter.close()
+            pywikibot.output("Prefetching used %d API calls." % self.prefetcher.api_calls)
+            pipeline.join()
+            pipeline.close()
+            self.page_store.close()
+            if journal is not None:
+                journal.close()
+            pywikibot.output("\nPages saved: " + str(self.saved_pages))
+        finally:
+            profiler.stop()  # Also unpatches api.Request.submit if the run fails
+        profiler.report()
 
 
 def main(*args):
     redirectfile = None
+    redirect_format = None
     oldredirect = None
     newredirect = None
     summary = None
     fix_double_redirects = True
+    table_templates = []
+    save_workers = 1
+    rewrite_workers = 1
+    edits_per_minute = None
+    page_store_file = None
+    journal_file = None
+    journal_sync = 5.0
+    resume = False
+    profile = False
+    profile_file = None
+    dump_file = None
+    patch_file = None
     link_log = None
     redirects = []
 
@@ -324,6 +1447,11 @@ def main(*args):
                     u'What file do you want the old and new redirects to be taken from?')
             else:
                 redirectfile = arg[14:]
+        elif arg.startswith("-redirectformat:"):
+            redirect_format = arg[16:]
+            if redirect_format not in RedirectFile.formats:
+                pywikibot.error("Unknown redirect file format %s." % redirect_format)
+                return
         elif arg.startswith("-oldredirect"):
             if len(arg) == 12:
                 oldredirect = pywikibot.input(
@@ -342,6 +1470,34 @@ def main(*args):
                     u'What summary would you like to use?')
             else:
                 summary = arg[9:]
+        elif arg.startswith("-tabletemplate"):
+            if len(arg) == 14:
+                table_templates.append(pywikibot.input(
+                    u'Which template marks the start of a table whose links should be fixed?'))
+            else:
+                table_templates.append(arg[15:])
+        elif arg.startswith("-saveworkers:"):
+            save_workers = int(arg[13:])
+        elif arg.startswith("-rewriteworkers:"):
+            rewrite_workers = int(arg[16:])
+        elif arg.startswith("-editrate:"):
+            edits_per_minute = float(arg[10:])
+        elif arg.startswith("-pagestore:"):
+            page_store_file = arg[11:]
+        elif arg.startswith("-journal:"):
+            journal_file = arg[9:]
+        elif arg.startswith("-journalsync:"):
+            journal_sync = float(arg[13:])
+        elif arg == "-resume":
+            resume = True
+        elif arg.startswith("-dump:"):
+            dump_file = arg[6:]
+        elif arg.startswith("-patch:"):
+            patch_file = arg[7:]
+        elif arg.startswith("-profile"):
+            profile = True
+            if len(arg) > 8:
+                profile_file = arg[9:]
         elif arg.startswith("-nofixdredirects"):
             fix_double_redirects = False
         elif arg.startswith("-linklog"):
@@ -356,22 +1512,11 @@ def main(*args):
     if redirectfile and (oldredirect or newredirect):
         pywikibot.output("Not using redirect file due to old redirect or new redirect being set.")
     if redirectfile and not oldredirect and not newredirect:
-        with codecs.open(redirectfile, 'r', config.textfile_encoding) as f:
-            for line_number, line in enumerate(f.readlines()):
-                if(line.startswith("#")):
-                    continue
-                try:
-                    line_eval = ast.literal_eval(line)
-                except ValueError:
-                    pywikibot.error("The redirect file contains an invalid line at line %s." % (line_number + 1))
-                else:
-                    if(type(line_eval) == tuple):
-                        if(len(line_eval) == 2):
-                            redirects.append(line_eval)
-                        else:
-                            pywikibot.error("The redirect file contains an invalid tuple at line %s." % (line_number + 1))
-                    else:
-                        pywikibot.error("Redirect file contains a line that isn't a tuple!")
+        try:
+            redirects = RedirectFile(redirectfile, redirect_format)
+        except ValueError as error:
+            pywikibot.error("%s" % error)
+            return
     elif oldredirect and newredirect:
         redirects.append((oldredirect, newredirect))
     elif oldredirect or newredirect:
@@ -381,7 +1526,29 @@ def main(*args):
         pywikibot.error("None of -oldredirect and -newredirect or -redirectfile specified!")
         return
 
-    bot = RedirectBot(summary, redirects, fix_double_redirects, link_log, gen_factory)
+    if patch_file:
+        if not dump_file:
+            pywikibot.error("-patch needs the -dump to read the pages from.")
+            return
+        DumpPreview(redirects, link_log, dump_file, patch_file, table_templates, rewrite_workers).run()
+        link_log.save()
+        return
+
+    journal = None
+    if journal_file:
+        journal = Journal(journal_file, resume, journal_sync)
+    elif resume:
+        pywikibot.error("-resume needs the -journal of the interrupted run.")
+        return
+    page_store = None
+    if page_store_file:
+        page_store = SQLitePageStore(pywikibot.Site(), page_store_file, resume)
+
+    bot = RedirectBot(summary, redirects, fix_double_redirects, link_log, gen_factory,
+                      table_templates=table_templates, save_workers=save_workers,
+                      edits_per_minute=edits_per_minute, page_store=page_store, journal=journal,
+                      rewrite_workers=rewrite_workers, profiler=PhaseProfiler(profile, profile_file),
+                      dump_file=dump_file)
     bot.run()
     link_log.save()
 
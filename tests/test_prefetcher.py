@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# test_prefetcher.py - Tests the batched lookups of rename_redirect against a stand-in API
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import unittest
+
+import pywikibot
+from pywikibot.data import api
+
+from scripts.rename_redirect import Prefetcher
+
+NAMESPACES = {0: '', 1: 'Talk', 2: 'User', 4: 'Project', 6: 'File', 10: 'Template', 14: 'Category'}
+
+
+class FakeWiki(object):
+
+    """Answers the API queries the Prefetcher makes from a few dicts.
+
+    Redirects are resolved the way MediaWiki does it: every hop of a chain
+    is listed, and a chain stops when it comes back to a title already
+    visited. At most link_limit backlinks are returned per request, with a
+    query-continue, or a continue if rawcontinue is ignored.
+    """
+
+    link_limit = 3
+
+    def __init__(self, pages=(), redirects=None, backlinks=None, ignore_rawcontinue=False):
+        self.pages = set(pages)
+        self.redirects = redirects or {}
+        self.backlinks = backlinks or {}
+        self.ignore_rawcontinue = ignore_rawcontinue
+        self.requests = []  # Parameters of each query
+
+    def siteinfo(self):
+        namespaces = {}
+        for number, name in NAMESPACES.items():
+            namespaces[str(number)] = {'id': number, '*': name, 'canonical': name, 'case': 'first-letter'}
+        return {'query': {
+            'general': {'generator': 'MediaWiki 1.25wmf1', 'case': 'first-letter', 'lang': 'en',
+                        'sitename': 'Wikipedia', 'mainpage': 'Main Page', 'server': '//en.wikipedia.org',
+                        'articlepath': '/wiki/$1', 'scriptpath': '/w', 'wikiid': 'enwiki'},
+            'namespaces': namespaces,
+            'namespacealiases': [{'id': 6, '*': 'Image'}]}}
+
+    def submit(self, request):
+        params = dict(request._params)
+        if params.get('meta') == ['siteinfo']:
+            return self.siteinfo()
+        self.requests.append(params)
+        if 'linkshere' in params.get('prop', []):
+            return self.linkshere(params)
+        return self.resolve(params['titles'])
+
+    def normalize(self, title):
+        title = title.replace("_", " ").strip()
+        return title[0].upper() + title[1:]
+
+    def page_data(self, title):
+        if title in self.pages or title in self.redirects:
+            return {'title': title, 'ns': 0, 'pageid': len(title)}
+        return {'title': title, 'ns': 0, 'missing': ''}
+
+    def resolve(self, titles):
+        normalized = []
+        redirects = {}
+        pages = {}
+        for title in titles:
+            current = self.normalize(title)
+            if current != title:
+                normalized.append({'from': title, 'to': current})
+            seen = set()
+            while current in self.redirects and current not in seen:
+                seen.add(current)
+                redirects[current] = {'from': current, 'to': self.redirects[current]}
+                current = self.redirects[current]
+            pages[current] = self.page_data(current)
+        query = {'pages': dict((str(-index), data) for index, data in enumerate(pages.values(), 1))}
+        if normalized:
+            query['normalized'] = normalized
+        if redirects:
+            query['redirects'] = list(redirects.values())
+        return {'query': query}
+
+    def linkshere(self, params):
+        links = []
+        for title in params['titles']:
+            for link_title in self.backlinks.get(title, []):
+                links.append((title, link_title))
+        start = int(params.get('lhcontinue', ['0'])[0])
+        batch = links[start:start + self.link_limit]
+        pages = {}
+        for title, link_title in batch:
+            page_data = pages.setdefault(title, self.page_data(title))
+            page_data.setdefault('linkshere', []).append({'title': link_title, 'ns': 0})
+        result = {'query': {'pages': dict((str(-index), data) for index, data in enumerate(pages.values(), 1))}}
+        if start + self.link_limit < len(links):
+            next_start = str(start + self.link_limit)
+            if 'rawcontinue' in params and not self.ignore_rawcontinue:
+                result['query-continue'] = {'linkshere': {'lhcontinue': next_start}}
+            else:
+                result['continue'] = {'lhcontinue': next_start, 'continue': '||'}
+        return result
+
+
+class PrefetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wiki = FakeWiki()
+        self.saved = (api.Request.submit, api.CachedRequest._load_cache, api.CachedRequest._write_cache)
+        wiki = self
+
+        def submit(request):
+            return wiki.wiki.submit(request)
+        api.Request.submit = submit
+        api.CachedRequest._load_cache = lambda request: False
+        api.CachedRequest._write_cache = lambda request, data: None
+        self.site = pywikibot.Site('en', 'wikipedia')
+
+    def tearDown(self):
+        (api.Request.submit, api.CachedRequest._load_cache, api.CachedRequest._write_cache) = self.saved
+
+    def page(self, title):
+        return pywikibot.Page(self.site, title)
+
+    def test_resolve_redirects_in_batches(self):
+        self.wiki = FakeWiki(pages=["Target", "Other"], redirects={"A": "Target", "B": "Target", "C": "Other"})
+        prefetcher = Prefetcher(self.site, batch_size=2)
+        prefetcher.resolve_redirects(["A", "B", "C", "A", "Missing", "Other"])
+        self.assertEqual([params['titles'] for params in self.wiki.requests],
+                         [["A", "B"], ["C", "Missing"], ["Other"]])
+        self.assertEqual(prefetcher.api_calls, 3)
+        self.assertEqual(prefetcher.redirect_target(self.page("B")).title(), "Target")
+        self.assertRaises(pywikibot.IsNotRedirectPage, prefetcher.redirect_target, self.page("Other"))
+        self.assertRaises(pywikibot.NoPage, prefetcher.check_exists, self.page("Missing"))
+        prefetcher.check_exists(self.page("Target"))
+        for title in ("A", "Target", "Missing", "Other"):
+            self.assertTrue(prefetcher.is_known(title))
+        self.assertFalse(prefetcher.is_known("Never asked"))
+
+    def test_redirect_chain_and_loop(self):
+        self.wiki = FakeWiki(pages=["End"], redirects={"First": "Second", "Second": "End",
+                                                       "Loop one": "Loop two", "Loop two": "Loop one"})
+        prefetcher = Prefetcher(self.site, batch_size=50)
+        prefetcher.resolve_redirects(["First", "Loop one"])
+        self.assertEqual(prefetcher.api_calls, 1)
+        # Double redirects are resolved one hop at a time, like Page.getRedirectTarget
+        self.assertEqual(prefetcher.redirect_target(self.page("First")).title(), "Second")
+        self.assertEqual(prefetcher.redirect_target(self.page("Second")).title(), "End")
+        self.assertRaises(pywikibot.CircularRedirect, prefetcher.redirect_target, self.page("Loop one"))
+        self.assertRaises(pywikibot.CircularRedirect, prefetcher.redirect_target, self.page("Loop two"))
+
+    def test_normalized_titles(self):
+        self.wiki = FakeWiki(pages=["New name"], redirects={"Old name": "New name"})
+        prefetcher = Prefetcher(self.site, batch_size=50)
+        prefetcher.resolve_redirects(["old_name", "new name"])
+        self.assertEqual(prefetcher.normalized, {"old_name": "Old name", "new name": "New name"})
+        self.assertTrue(prefetcher.is_known("old_name"))
+        self.assertEqual(prefetcher.redirect_target(self.page("old_name")).title(), "New name")
+
+    def check_backlinks(self, ignore_rawcontinue):
+        self.wiki = FakeWiki(pages=["A", "B", "C"], ignore_rawcontinue=ignore_rawcontinue, backlinks={
+            "A": ["P1", "P2", "P3", "P4"],
+            "B": ["P2", "P5"],
+            "C": ["P1", "P6"],
+        })
+        prefetcher = Prefetcher(self.site, batch_size=2)
+        titles = [page.title() for page in prefetcher.backlinks(["C", "A", "B", "A"])]
+        self.assertEqual(sorted(titles), ["P1", "P2", "P3", "P4", "P5", "P6"])
+        # A and B have 6 links, 3 per request, then C in a batch of its own
+        self.assertEqual([params['titles'] for params in self.wiki.requests],
+                         [["A", "B"], ["A", "B"], ["C"]])
+        self.assertEqual(prefetcher.api_calls, 3)
+        return self.wiki.requests
+
+    def test_backlinks_query_continue(self):
+        requests = self.check_backlinks(ignore_rawcontinue=False)
+        for params in requests:
+            self.assertIn('rawcontinue', params)
+        self.assertEqual(requests[1]['lhcontinue'], ["3"])
+
+    def test_backlinks_continue(self):
+        requests = self.check_backlinks(ignore_rawcontinue=True)
+        self.assertEqual(requests[1]['lhcontinue'], ["3"])
+        self.assertEqual("|".join(requests[1]['continue']), "||")  # Split on | like any list value
+
+
+if __name__ == '__main__':
+    unittest.main()
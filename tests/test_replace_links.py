@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# test_replace_links.py - Compares replace_links with the per-redirect version it replaced
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import random
+import re
+import unittest
+
+from scripts.rename_redirect import replace_links
+
+
+def reference_replace_links(to_replace, replacement, text, dry=False):
+    # RedirectBot.replace_links before the single pass rewrite, except that
+    # an empty [[]] link no longer makes it search from the same position
+    # forever.
+    replaced = 0
+    old_text = text
+    link_pattern = re.compile(
+        r'(?<=\[\[)(?P<title>.*?)(?:#(?P<section>.*?))?(?:\|.*?)?(?=\]\])')
+    curpos = 0
+
+    while True:
+        match = link_pattern.search(text, pos=curpos)
+        if not match:
+            break
+        if not match.group('title').strip():
+            curpos = max(match.end(), match.start() + 1)
+            continue
+        title = match.group('title')
+        if title.startswith("File:") or title.startswith("Category:"):
+            curpos = match.end('title')
+            continue
+        if title == to_replace:
+            replaced += 1
+            text = text[0:match.start('title')] + replacement + text[match.end('title'):len(text)]
+            curpos = match.end('title') + (len(text) - len(old_text))
+        curpos = match.end('title')
+    if dry:
+        return replaced
+    else:
+        return (replaced, text)
+
+
+# No new title is shorter than its old one: the old scan carried on from
+# the end of the link in the text before the replacement, so it skipped the
+# links right after a shortened one (see test_shorter_title).
+REDIRECTS = {
+    "XHAB-TV": "XHAB-TDT",
+    "XEW-TV": "XEW-TDT",
+    "Canal 5": "Canal 5 (Mexico)",
+}
+
+SHAPES = [
+    "[[%(old)s]]",
+    "[[%(old)s|%(old)s]]",
+    "[[%(old)s|channel 2]]",
+    "[[%(old)s#History]]",
+    "[[%(old)s#History|history]]",
+    "[[%(old)s]]s",
+    "[[Other page]]",
+    "[[Other page|%(old)s]]",
+    "[[File:%(old)s.png|thumb|[[%(old)s]] transmitter]]",
+    "[[Category:%(old)s]]",
+    "[[Category:Television stations|%(old)s]]",
+    "[[]]",
+    "[[ ]]",
+    "[[[%(old)s]]]",
+    "[[%(old)s]][[%(old)s]]",
+    "{{Infobox|[[%(old)s]]}}",
+    "{| class=\"wikitable\"\n|-\n| [[%(old)s]] || 2\n|}",
+    "%(old)s",
+    "[[%(old)s",
+    "\n",
+    " ",
+]
+
+
+def corpus(pages=300, seed=24):
+    generator = random.Random(seed)
+    titles = sorted(REDIRECTS) + ["Unrelated"]
+    for page in range(pages):
+        parts = []
+        for part in range(generator.randint(1, 25)):
+            parts.append(generator.choice(SHAPES) % {'old': generator.choice(titles)})
+        yield "".join(parts)
+
+
+class ReplaceLinksTest(unittest.TestCase):
+
+    def test_single_redirect(self):
+        for text in corpus():
+            for old_title, new_title in sorted(REDIRECTS.items()):
+                self.assertEqual(replace_links({old_title: new_title}, text),
+                                 reference_replace_links(old_title, new_title, text))
+                self.assertEqual(replace_links({old_title: new_title}, text, dry=True),
+                                 reference_replace_links(old_title, new_title, text, dry=True))
+
+    def test_all_redirects(self):
+        # The old bot fixed the links to one redirect after the other
+        for text in corpus():
+            expected_text = text
+            expected_replaced = 0
+            expected_count = 0
+            for old_title, new_title in sorted(REDIRECTS.items()):
+                expected_count += reference_replace_links(old_title, new_title, expected_text, dry=True)
+                (replaced, expected_text) = reference_replace_links(old_title, new_title, expected_text)
+                expected_replaced += replaced
+            self.assertEqual(replace_links(REDIRECTS, text), (expected_replaced, expected_text))
+            self.assertEqual(replace_links(REDIRECTS, text, dry=True), expected_replaced)
+
+    def test_shorter_title(self):
+        text = "[[Televisa Regional]][[Televisa Regional|TR]] [[Televisa Regional#Stations]]"
+        self.assertEqual(replace_links({"Televisa Regional": "Televisa"}, text),
+                         (3, "[[Televisa]][[Televisa|TR]] [[Televisa#Stations]]"))
+        self.assertEqual(replace_links({"Televisa Regional": "Televisa"}, text, dry=True), 3)
+        self.assertEqual(reference_replace_links("Televisa Regional", "Televisa", text)[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Bot24 - A bot for performing misc tasks on Wikimedia sites
+# test_title_index.py - Tests the link matching of rename_redirect's TitleIndex
+# Copyright (C) 2015 Jamison Lofthouse
+#
+# This file is part of Bot24.
+#
+# Bot24 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bot24 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bot24.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import pickle
+import unittest
+
+from scripts.rename_redirect import TitleIndex, replace_links
+
+
+class TitleIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TitleIndex({
+            "XHAB-TV": "XHAB-TDT",
+            "Canal 5 (Mexico)": "Canal 5",
+            "Talk:Old station": "Talk:New station",
+            "File:Old logo.png": "File:New logo.png",
+            "Category:Old stations": "Category:New stations",
+            "Old list": "Category:Station lists",
+        })
+
+    def test_first_letter_case(self):
+        self.assertEqual(self.index.get("xHAB-TV"), "XHAB-TDT")
+        self.assertEqual(self.index.get("canal 5 (Mexico)"), "Canal 5")
+        self.assertEqual(self.index.get("Canal 5 (mexico)"), None)  # Only the first letter is case-insensitive
+        self.assertEqual(self.index.get("talk:old station"), "Talk:New station")
+
+    def test_underscores_and_whitespace(self):
+        for title in ("Canal_5_(Mexico)", "Canal  5 (Mexico)", " Canal 5 (Mexico) ", "Canal_ 5\t(Mexico)"):
+            self.assertEqual(self.index.get(title), "Canal 5", title)
+        for title in ("Talk:_Old_station", "Talk : Old station", "Talk:Old__station"):
+            self.assertEqual(self.index.get(title), "Talk:New station", title)
+
+    def test_namespace_prefix(self):
+        self.assertEqual(self.index.get("TALK:Old station"), "Talk:New station")
+        self.assertEqual(self.index.get("Old station"), None)
+        self.assertEqual(self.index.get(":image:old_logo.png"), ":File:New logo.png")
+        self.assertEqual(self.index.get(":File:Old logo.png"), ":File:New logo.png")
+
+    def test_file_and_category_links_are_skipped(self):
+        for title in ("File:Old logo.png", "Image:Old logo.png", "image:old logo.png",
+                      "Category:Old stations", "category:old_stations"):
+            self.assertEqual(self.index.get(title), None, title)
+
+    def test_linked_category(self):
+        self.assertEqual(self.index.get(":Category:Old stations"), ":Category:New stations")
+        self.assertEqual(self.index.get(" : category:Old stations"), ":Category:New stations")
+        text = "[[:Category:Old stations|stations]] [[Category:Old stations]] [[category:Old stations]]"
+        self.assertEqual(replace_links(self.index, text),
+                         (1, "[[:Category:New stations|stations]] [[Category:Old stations]] [[category:Old stations]]"))
+
+    def test_new_title_in_category_namespace(self):
+        # Rewriting [[Old list]] to [[Category:Station lists]] would categorise the page
+        self.assertEqual(self.index.get("Old list"), ":Category:Station lists")
+        self.assertEqual(replace_links(self.index, "See [[Old list|the list]]."),
+                         (1, "See [[:Category:Station lists|the list]]."))
+
+    def test_memoized_lookups_and_pickling(self):
+        self.assertEqual(self.index.get("xHAB-TV"), "XHAB-TDT")
+        self.assertEqual(self.index.get("xHAB-TV"), "XHAB-TDT")
+        self.assertEqual(self.index.get("Unrelated", "default"), "default")
+        copy = pickle.loads(pickle.dumps(self.index))  # Sent to the rewrite workers
+        self.assertEqual(copy.get(":Category:Old stations"), ":Category:New stations")
+
+
+if __name__ == '__main__':
+    unittest.main()